@@ -3,17 +3,170 @@
 import os, sys
 from dotenv import load_dotenv
 load_dotenv() # load the .env keys
-import logging
-import json, re, datetime, threading
+import logging, logging.handlers
+import queue, datetime, time, gzip, shutil, threading, dataclasses, ipaddress, contextlib, functools, atexit
 from MuliLanguageMessages import MulitLanguageMessages
+from RoutingIndex import RoutingIndex
+from DatabaseStorage import JSONStorage, SQLiteStorage
+from DatabaseRecords import Chat, User, Mute
+from SharedState import CowDict
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class Settings:
+    ''' The parsed and validated settings from the .env file. Built once at startup, use the attributes instead of os.getenv. '''
+    broadcast_ip: str
+    broadcast_port: int
+    wintest_subnet: str
+    telegram_token: str = dataclasses.field(repr=False) # keep secrets out of the logs
+    magic_key: str = dataclasses.field(repr=False)
+    super_user_key: str = dataclasses.field(repr=False)
+    default_lang: str
+    languagepack_path: str
+    log_file_path: str
+    database_file_path: str
+    database_backend: str
+    database_sqlite_path: str
+    db_flush_delay: float
+    file_logging_level: str
+    console_logging_level: str
+    keep_n_old_logs: int
+    log_max_bytes: int
+    log_rotate_hours: float
+    log_queue_size: int
+    log_digest_window: float
+    wt_stn_limit: int
+    wt_msg_limit: int
+    wt_call_prefix: str
+    wt_call_suffix: str
+    wt_wd_timeout: float
+    wt_echo_ttl: float
+    wt_echo_capacity: int
+    wt_packet_log_sample: int
+    tg_confirm_default: bool
+    tg_message_ttl: float
+    tg_digest_window: float
+    tg_board_interval: float
+    spool_file_path: str
+
+    @property
+    def wt_name_limit(self):
+        ''' Max. no. of characters of a Win-Test display name, the station limit without prefix and suffix '''
+        return self.wt_stn_limit - len(self.wt_call_prefix) - len(self.wt_call_suffix)
+
+def loadSettings():
+    ''' Reads all settings from the environment and validates them. Exits with a message listing all problems if the configuration is invalid. '''
+    errors = []
+
+    def get(key, default = None):
+        value = os.getenv(key, default)
+        if value == None:
+            errors.append(key + ' is missing')
+            return ''
+        return value
+
+    def getInt(key, default = None, minimum = 0, maximum = None):
+        try:
+            value = int(get(key, default))
+        except ValueError:
+            errors.append(key + ' must be an integer')
+            return 0
+        if value < minimum or (maximum != None and value > maximum):
+            errors.append(key + ' is out of range')
+        return value
+
+    def getFloat(key, default = None, allowZero = False):
+        try:
+            value = float(get(key, default))
+        except ValueError:
+            errors.append(key + ' must be a number')
+            return 0.0
+        if value < 0 or (value == 0 and not allowZero):
+            errors.append(key + (' must not be negative' if allowZero else ' must be positive'))
+        return value
+
+    def getBool(key, default = None):
+        value = get(key, default).strip().lower()
+        if value not in ('true', 'false', '1', '0', 'yes', 'no', 'on', 'off'):
+            errors.append(key + ' must be True or False')
+        return value in ('true', '1', 'yes', 'on')
+
+    def getChoice(key, choices, default = None):
+        value = get(key, default).strip().lower()
+        if value not in choices:
+            errors.append(key + ' must be one of ' + ', '.join(choices))
+        return value
+
+    def getIP(key, default = None):
+        value = get(key, default)
+        try:
+            ipaddress.IPv4Address(value)
+        except ValueError:
+            errors.append(key + ' is not a valid IPv4 address')
+        return value
+
+    def getLevel(key, default = None):
+        value = get(key, default).upper()
+        if not isinstance(logging.getLevelName(value), int):
+            errors.append(key + ' is not a valid logging level')
+        return value
+
+    settings = Settings(broadcast_ip = getIP('BROADCAST_IP'),
+                        broadcast_port = getInt('BROADCAST_PORT', minimum = 1, maximum = 65535),
+                        wintest_subnet = getIP('WINTEST_SUBNET', '255.255.255.0'),
+                        telegram_token = get('TELEGRAM_TOKEN'),
+                        magic_key = get('MAGIC_KEY'),
+                        super_user_key = get('SUPER_USER_KEY'),
+                        default_lang = get('DEFAULT_LANG', 'en').lower(),
+                        languagepack_path = get('LANGUAGEPACK_PATH', 'lang/'),
+                        log_file_path = get('LOG_FILE_PATH', 'data/wttgbot.log'),
+                        database_file_path = get('DATABASE_FILE_PATH', 'data/wttgbot.json'),
+                        database_backend = getChoice('DATABASE_BACKEND', ('json', 'sqlite'), 'json'),
+                        database_sqlite_path = get('DATABASE_SQLITE_PATH', 'data/wttgbot.sqlite'),
+                        db_flush_delay = getFloat('DB_FLUSH_DELAY', '2'),
+                        file_logging_level = getLevel('FILE_LOGGING_LEVEL', 'INFO'),
+                        console_logging_level = getLevel('CONSOLE_LOGGING_LEVEL', 'INFO'),
+                        log_queue_size = getInt('LOG_QUEUE_SIZE', '10000', minimum = 1),
+                        log_digest_window = getFloat('LOG_DIGEST_WINDOW', '10'),
+                        keep_n_old_logs = getInt('KEEP_N_OLD_LOGS', '30'),
+                        log_max_bytes = getInt('LOG_MAX_BYTES', '10000000'),
+                        log_rotate_hours = getFloat('LOG_ROTATE_HOURS', '24', allowZero = True), # 0 disables the rotation by age
+                        wt_stn_limit = getInt('WT_STN_LIMIT', '10', minimum = 1),
+                        wt_msg_limit = getInt('WT_MSG_LIMIT', '79', minimum = 1),
+                        wt_call_prefix = get('WT_CALL_PREFIX', ''),
+                        wt_call_suffix = get('WT_CALL_SUFFIX', ''),
+                        wt_wd_timeout = getFloat('WT_WD_TIMEOUT', '120'),
+                        wt_echo_ttl = getFloat('WT_ECHO_TTL', '10'),
+                        wt_echo_capacity = getInt('WT_ECHO_CAPACITY', '1024', minimum = 1),
+                        wt_packet_log_sample = getInt('WT_PACKET_LOG_SAMPLE', '1'),
+                        tg_confirm_default = getBool('TG_CONFIRM_DEFAULT', 'True'),
+                        tg_message_ttl = getFloat('TG_MESSAGE_TTL', '900'),
+                        tg_digest_window = getFloat('TG_DIGEST_WINDOW', '2'),
+                        tg_board_interval = getFloat('TG_BOARD_INTERVAL', '10'),
+                        spool_file_path = get('SPOOL_FILE_PATH', 'data/wttgbot.spool'))
+
+    if not errors and settings.wt_name_limit < 1:
+        errors.append('WT_CALL_PREFIX and WT_CALL_SUFFIX leave no room for a name within WT_STN_LIMIT')
+    if errors: # the logger is not set up yet, just tell the user and quit
+        sys.exit('[CONFIG] Invalid configuration in .env:\n  ' + '\n  '.join(errors))
+    return settings
+
+settings = loadSettings()
 
 
 class TelegramLoggingHandler(logging.Handler):
-        ''' An class which provides the handler to also send messages to telegram. '''
+        ''' An class which provides the handler to also send messages to telegram. The records are collected for LOG_DIGEST_WINDOW seconds and sent as one digest,
+        repeated records (same logger, message template and level) are collapsed into a single line with a count. '''
+
+        MAX_ENTRIES = 20 # max. no. of different records listed in one digest
+        MAX_LINE = 300 # max. no. of characters of a single record in the digest
+
         def __init__(self, chat_id,level = 40) -> None:
             '''Store the target chat_id and log level for this instance'''
             super().__init__()
             self.chat_id = chat_id
+            self._pending = {} # (logger, message template, level) -> [count, level name, first message], in order of appearance
+            self._timer = None # flushes the pending records at the end of the window
             try:
                 self.level = int(level) # try to get the level, revert to 'ERROR' if it fails
             except:
@@ -31,255 +184,479 @@ class TelegramLoggingHandler(logging.Handler):
             log.debug('[TLH] Logging level updated to '+ str(newlevel))
 
         def emit(self, record):
-            ''' The function which is called on each logging event, passes the logging event to telegram using the handler which is set up by the main script'''
-            if 'cannot schedule new futures after shutdown' in record.message or 'httpx.ConnectError' in record.message or 'All connections in the connection pool are occupied.' in record.message: # we're logging recursive execptions, and we're probably the cause of it. break the loop! Smarter solutions will exist..
+            ''' The function which is called on each logging event, adds the record to the digest of the current window '''
+            if getattr(record, 'telegram_delivery', False): # the record is about sending to telegram, possibly caused by us. Sending it would loop.
                 return
-            
-            if record.levelno >= self.level: # record passed the threshold
-                try:
-                    messageLogCallback(self.chat_id,'\U0001F6A7 LOGGING EVENT \U0001F6A7 \n[' + record.levelname + '] ' + record.message)
-                except: # this exception is not needed, the error is logged anyways
-                    pass
+            if record.levelno < self.level: # record did not pass the threshold
+                return
+            key = (record.name, record.msg, record.levelno)
+            entry = self._pending.get(key) # emit() and flush() hold the handler lock
+            if entry != None:
+                entry[0] += 1
+                return
+            self._pending[key] = [1, record.levelname, record.getMessage()] # the record may not be formatted yet, see LogQueueHandler
+            if self._timer == None: # first record of a new window
+                self._timer = threading.Timer(settings.log_digest_window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        def flush(self):
+            ''' Sends the digest of the pending records to telegram, using the handler which is set up by the main script '''
+            with self.lock:
+                pending = self._pending
+                self._pending = {}
+                self._timer = None
+            if not pending:
+                return
+            lines = []
+            for count, levelname, message in list(pending.values())[:self.MAX_ENTRIES]:
+                if len(message) > self.MAX_LINE:
+                    message = message[:self.MAX_LINE] + '...'
+                lines.append('[' + levelname + '] ' + message + (' (\u00d7' + str(count) + ')' if count > 1 else ''))
+            if len(pending) > self.MAX_ENTRIES:
+                lines.append('... and ' + str(len(pending) - self.MAX_ENTRIES) + ' more')
+            _logContext.delivering = True # everything logged while handing over the digest is marked, see markDelivery
+            try:
+                messageLogCallback(self.chat_id,'\U0001F6A7 LOGGING EVENT \U0001F6A7 \n' + '\n'.join(lines))
+            except: # this exception is not needed, the error is logged anyways
+                pass
+            finally:
+                _logContext.delivering = False
+
+        def close(self):
+            with self.lock:
+                if self._timer != None:
+                    self._timer.cancel()
+                    self._timer = None
+            super().close()
 
 
 def loadDatabase():
-    ''' Function used to load the userdata'''
-    
-    # load the json data
+    ''' Function used to load the userdata. Returns the on-disk form, it is migrated before the records are created. '''
+    data = storage.load()
+    if data != None:
+        log.info('[CONFIG] Confdiguration found and loaded')
+        return data
+    log.warning('[CONFIG] The user data is not present. If this is the first start of the bot, this is expected.')
+    return {}, {}, SCHEMA_VERSION
+
+def storeDatabase(chatIDs = None, usernames = None):
+    ''' Marks chats and users as modified. The changes are written to the harddrive by a background timer after DB_FLUSH_DELAY seconds, within a transaction when it ends.
+    Without arguments the whole database is marked as modified. '''
+    global _dbDirty, _dbTimer, _dbDirtyChats, _dbDirtyUsers
+    with _dbLock:
+        if chatIDs == None and usernames == None: # everything changed
+            _dbDirtyChats = _dbDirtyUsers = None
+        elif _dbDirtyChats != None:
+            _dbDirtyChats.update(chatIDs or ())
+            _dbDirtyUsers.update(usernames or ())
+        _dbDirty = True
+        if _dbTransactions > 0 or _dbTimer != None: # a write is already pending
+            return
+        _dbTimer = threading.Timer(settings.db_flush_delay, flushDatabase, kwargs={'timed' : True})
+        _dbTimer.daemon = True
+        _dbTimer.start()
+
+def flushDatabase(timed = False):
+    ''' Function to write pending updates of the database to the harddrive. The file is replaced atomically. Called by the timer and on shutdown.
+    The timer (`timed`) does not write while a transaction is open, the end of the transaction schedules the write again. '''
+    global _dbDirty, _dbTimer, _dbDirtyChats, _dbDirtyUsers
+    with _dbFlushLock: # only one writer at a time
+        with _dbLock: # take the changes while nobody changes the data
+            if _dbTimer != None:
+                _dbTimer.cancel()
+                _dbTimer = None
+            if not _dbDirty or (timed and _dbTransactions > 0): # the timer was armed before the transaction started, do not write a half-applied state
+                return
+            data = storage.prepare(chats, users, _dbDirtyChats, _dbDirtyUsers, SCHEMA_VERSION)
+            _dbDirty = False
+            _dbDirtyChats = set()
+            _dbDirtyUsers = set()
+        try:
+            storage.write(data)
+            log.debug('[CONFIG] Database file updated.')
+        except Exception as e:
+            log.error('[CONFIG] Writing data file failed. Reason: ' + str(e))
+            storeDatabase() # try again later, write everything to be safe
+
+@contextlib.contextmanager
+def transaction():
+    ''' Context to group multiple changes of the database into a single write, e.g. `with cf.transaction(): ...` '''
+    global _dbTransactions
+    with _dbLock:
+        _dbTransactions += 1
     try:
-        os.makedirs(os.path.dirname(os.getenv('DATABASE_FILE_PATH')), exist_ok=True) # on first start, make sure all the paths are ok
-        with open(os.getenv('DATABASE_FILE_PATH')) as f:
-            data = json.loads(f.read())
-        if data.get('chats') != None and data.get('users') != None: # check the format
-            log.info('[CONFIG] Confdiguration found and loaded')
-            return data['chats'], data['users']
+        yield
+    finally:
+        with _dbLock:
+            _dbTransactions -= 1
+            pending = _dbDirty and _dbTransactions == 0
+        if pending:
+            storeDatabase(()) # the changes are marked already, just schedule the write
+
+def closeDatabase():
+    ''' Writes pending changes and closes the storage. Called on exit. '''
+    flushDatabase()
+    storage.close()
+
+def findGroupChat(groupname):
+    ''' Returns the chat id of the group chat with the given name, None if there is none. If several groups have this name, the oldest one is returned. '''
+    found = groups.get(groupname) # a tuple, never changed in place
+    return found[0] if found else None
+
+def _indexGroup(chat, old, new):
+    ''' Moves a chat in the group name index from its old to its new record, either one may be None. Needs the _dbLock. '''
+    if old != None and new != None and old.groupname == new.groupname and old.is_private == new.is_private:
+        return
+    if old != None and old.is_private == False:
+        remaining = tuple(c for c in groups.get(old.groupname, ()) if c != chat)
+        if remaining:
+            groups[old.groupname] = remaining
         else:
-            log.warning('[CONFIG] The user data is not present. If this is the first start of the bot, this is expected.')
-            return {}, {}
-    except Exception as e:
-        log.warning('[CONFIG] The user data is not present. If this is the first start of the bot, this is expected.')
-        return {}, {}
-
-def storeDatabase():
-    ''' Function to store updates to the database on the harddrive. '''
-    try:
-        data = {}
-        data['users'] = users
-        data['chats'] = chats
-        with open(os.getenv('DATABASE_FILE_PATH'), 'w') as f:
-            f.write(json.dumps(data))
-        log.debug('[CONFIG] Database file updated.')
-    except Exception as e:
-        log.error('[CONFIG] Writing data file failed. Reason: ' + str(e))
-
-def checkDatabase(chats, users, modified = False):
-    ''' Check the database integity. Also good to insert new attributes into existing instances after an update. '''    
-    for chat in chats:
-        if chats[chat].get('langcode') == None:
-            chats[chat]['langcode'] = os.getenv('DEFAULT_LANG')
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, missing langcode. Restoring to default.')
-            return checkDatabase(chats, users, modified)
-            
-        if chats[chat].get('valid') == None:
-            chats[chat]['valid'] = False
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, missing validation. Restoring to default.')
-            return checkDatabase(chats, users, modified)
-            
-        if chats[chat].get('is_private') == None:
+            groups.pop(old.groupname, None)
+    if new != None and new.is_private == False:
+        groups[new.groupname] = groups.get(new.groupname, ()) + (chat,)
+
+def _locked(func):
+    ''' Decorator for the functions changing the database, the background writer must not serialize the data while it is changed. '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _dbLock:
+            return func(*args, **kwargs)
+    return wrapper
+
+def _migrateAttributes(chats, users):
+    ''' Version 1, the first versioned schema: insert the attributes which are missing in databases of earlier versions. Chats without private tag are deleted. '''
+    changed = 0
+    for chat, data in list(chats.items()):
+        if data.get('is_private') == None:
             chats.pop(chat)
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, missing private tag. Deleting this chat.')
-            return checkDatabase(chats, users, modified)
-            
-        if chats[chat].get('mute') == None:
-            chats[chat]['mute'] = 'none' if chats[chat]['is_private'] == False else 'own'
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, missing mute tag. Restoring to default.')
-            return checkDatabase(chats, users, modified)
-            
-        if chats[chat].get('user') == None:
-            chats[chat]['user'] = ''
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, missing user tag. Restoring to default.')
-            return checkDatabase(chats, users, modified)
-            
-        elif chats[chat]['user'] != '' and users.get(chats[chat]['user']) == None:
-            chats[chat]['user'] = ''
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, referenced user non existing. Restoring to default.')
-            return checkDatabase(chats, users, modified)
-            
-        if chats[chat].get('wt_confirm') == None:
-            chats[chat]['wt_confirm'] = True
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, missing wt_confirm tag. Restoring to default.')
-            return checkDatabase(chats, users, modified)
-            
-        if chats[chat].get('tg_to_tg') == None:
-            chats[chat]['tg_to_tg'] = True
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, missing tg_to_tg tag. Restoring to default.')
-            return checkDatabase(chats, users, modified)
-        
-        if chats[chat].get('groupname') == None:
-            chats[chat]['groupname'] = ''
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, missing groupname tag. Restoring to default.')
-            return checkDatabase(chats, users, modified)
-            
-
-    for user in users:
-        if users[user].get('wt_dispname') == None:
-            users[user]['wt_dispname'] = ''
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, missing wt_dispname tag. Restoring to default.')
-            return checkDatabase(chats, users, modified)
-            
-        if users[user].get('chat_id') == None:
-            users[user]['chat_id'] = ''
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, missing chat_id tag. Restoring to default.')
-            return checkDatabase(chats, users, modified)
-            
-        elif users[user]['chat_id'] != '' and chats.get(users[user]['chat_id']) == None:
-            users[user]['chat_id'] = ''
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, user is referncing non-existing chat. Restoring to default.')
-            return checkDatabase(chats, users, modified)
-            
-        if users[user].get('log_level') == None:
-            users[user]['log_level'] = 'none'
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, missing log_level tag. Restoring to default.')
-            return checkDatabase(chats, users, modified)
-            
-        if users[user].get('is_superuser') == None:
-            users[user]['is_superuser'] = False
-            modified = True
-            log.warning('[CONFIG] Database integretry compromised, missing is_superuser tag. Restoring to default.')
-            return checkDatabase(chats, users, modified)           
-
-    return chats, users, modified
+            changed += 1
+            continue
+        defaults = {'langcode' : settings.default_lang,
+                    'valid' : False,
+                    'mute' : 'none' if data['is_private'] == False else 'own',
+                    'user' : '',
+                    'wt_confirm' : True,
+                    'tg_to_tg' : True,
+                    'groupname' : ''}
+        changed += _insertDefaults(data, defaults)
+    defaults = {'wt_dispname' : '',
+                'chat_id' : '',
+                'log_level' : 'none',
+                'is_superuser' : False}
+    for data in users.values():
+        changed += _insertDefaults(data, defaults)
+    return changed
+
+def _insertDefaults(data, defaults):
+    ''' Set the missing attributes of a record to their default. Returns 1 if the record was changed, 0 otherwise. '''
+    changed = 0
+    for key, value in defaults.items():
+        if data.get(key) == None:
+            data[key] = value
+            changed = 1
+    return changed
+
+def _migrateDigest(chats, users):
+    ''' Version 2: the digest mode, off for all existing chats '''
+    changed = 0
+    for data in chats.values():
+        changed += _insertDefaults(data, {'digest' : False})
+    return changed
+
+def _migrateBoard(chats, users):
+    ''' Version 3: the status board, no chat has one yet '''
+    changed = 0
+    for data in chats.values():
+        changed += _insertDefaults(data, {'board' : 0})
+    return changed
+
+# The schema version of the database and the steps to get there, in order. Every step brings the database from the previous version to its version.
+SCHEMA_VERSION = 3
+MIGRATIONS = [(1, 'insert missing attributes', _migrateAttributes),
+              (2, 'digest mode', _migrateDigest),
+              (3, 'status board', _migrateBoard)]
+
+def checkReferences(chats, users):
+    ''' Check the links between chats and users, references to non-existing records are restored to default. Returns the number of fixed references. '''
+    fixed = 0
+    for data in chats.values():
+        if data['user'] != '' and users.get(data['user']) == None:
+            data['user'] = ''
+            fixed += 1
+    for data in users.values():
+        if data['chat_id'] != '' and chats.get(data['chat_id']) == None:
+            data['chat_id'] = ''
+            fixed += 1
+    return fixed
+
+def migrateDatabase(chats, users, version):
+    ''' Bring the database from the given schema version to the current one in a single pass over the migration steps, then check the references. Returns True if the database was modified. '''
+    modified = False
+    if version > SCHEMA_VERSION:
+        log.warning('[CONFIG] The database has schema version ' + str(version) + ', this version of the bot only knows up to ' + str(SCHEMA_VERSION) + '. Trying anyways.')
+    for stepVersion, description, step in MIGRATIONS:
+        if stepVersion <= version:
+            continue
+        changed = step(chats, users)
+        log.info('[CONFIG] Database migrated to schema version ' + str(stepVersion) + ' (' + description + '), ' + str(changed) + ' records changed.')
+        modified = True
+    fixed = checkReferences(chats, users)
+    if fixed > 0:
+        log.warning('[CONFIG] Database integretry compromised, ' + str(fixed) + ' references to non-existing chats or users. Restoring to default.')
+        modified = True
+    return modified
 
         
         
 
+class LogQueueHandler(logging.handlers.QueueHandler):
+    ''' Puts the log records into a bounded queue, the actual handlers are run by a background listener. Never blocks, records are dropped if the queue is full. '''
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0 # no. of records lost because the queue was full
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1 # handle() holds the handler lock, no race here
+
+    def prepare(self, record):
+        ''' The listener runs in this process, so the record is passed on as it is. The message is formatted by the handlers on the listener thread, not by the caller. '''
+        return record
+
+
+def markDelivery(record):
+    ''' Logging filter, runs in the thread which logs. Records logged while a log digest is handed to telegram are marked, so they are not sent to telegram again.
+    Code which logs problems of the telegram delivery itself marks its records with extra={'telegram_delivery': True}. '''
+    if getattr(_logContext, 'delivering', False):
+        record.telegram_delivery = True
+    return True
+
+class LogFileHandler(logging.FileHandler):
+    ''' File handler which starts a new log file when the current one exceeds `maxBytes` or is older than `rotateSeconds` (0 to disable either).
+    The old file gets a timestamp suffix and is compressed with gzip by a background thread, which also deletes all but the last `keep` old files.
+    The log file of the previous run is rotated the same way on startup. '''
+
+    def __init__(self, path, level, maxBytes, rotateSeconds, keep):
+        os.makedirs(os.path.dirname(path), exist_ok=True) # on first start, make sure all the paths are ok
+        self.levelName = level
+        self.maxBytes = maxBytes
+        self.rotateSeconds = rotateSeconds
+        self.keep = keep
+        self._jobLock = threading.Lock() # one compression/cleanup job at a time
+        self._lastStamp = 0 # microseconds of the last segment name
+        if os.path.exists(path) and os.path.getsize(path) > 0: # log of the previous run
+            os.rename(path, self._segmentName(path))
+        super().__init__(path, mode='w', encoding='utf-8')
+        self.setLevel(level)
+        self._startFile()
+        self._startJob() # also compresses segments which were left uncompressed and cleans up
+
+    def _startFile(self):
+        ''' Write the header of a new log file and restart the size and time limits '''
+        header = 'Win-Test Telegram Bot log file with Level: ' + self.levelName + ', start time: ' + datetime.datetime.now().strftime('%d %b %Y, %H:%M:%S') + '\n'
+        self.stream.write(header)
+        self.stream.flush()
+        self._size = len(header)
+        self._rolloverAt = time.time() + self.rotateSeconds if self.rotateSeconds else float('inf') # no rotation by age
+
+    def _segmentName(self, path):
+        ''' The name of a rotated log file, a timestamp with microseconds which sorts by age. A name is never reused, the cleanup deletes the oldest names. '''
+        stamp = max(time.time_ns() // 1000, self._lastStamp + 1) # several rotations within the same microsecond still get increasing names
+        while os.path.exists(path + '.' + self._formatStamp(stamp)) or os.path.exists(path + '.' + self._formatStamp(stamp) + '.gz'): # e.g. the clock was set back
+            stamp += 1
+        self._lastStamp = stamp
+        return path + '.' + self._formatStamp(stamp)
+
+    @staticmethod
+    def _formatStamp(stamp):
+        ''' YYYYmmdd-HHMMSS-ffffff of a timestamp in microseconds '''
+        return time.strftime('%Y%m%d-%H%M%S', time.localtime(stamp // 1000000)) + '-%06d' % (stamp % 1000000)
+
+    def emit(self, record):
+        try:
+            if (self.maxBytes and self._size >= self.maxBytes) or record.created >= self._rolloverAt:
+                self.doRollover()
+            msg = self.format(record) + self.terminator
+            self.stream.write(msg)
+            self.stream.flush()
+            self._size += len(msg) # characters, not bytes, good enough for the limit
+        except Exception:
+            self.handleError(record)
+
+    def doRollover(self):
+        ''' Renaming and reopening is all we do here, compressing is left to the background thread so logging does not stall '''
+        self.stream.close()
+        os.rename(self.baseFilename, self._segmentName(self.baseFilename))
+        self.stream = self._open()
+        self._startFile()
+        self._startJob()
+
+    def _startJob(self):
+        threading.Thread(target=self._housekeeping, name='LogCompressor', daemon=True).start()
+
+    def _housekeeping(self):
+        ''' Compress all rotated log files which are not compressed yet and delete the oldest ones beyond `keep` '''
+        with self._jobLock:
+            logdir = os.path.dirname(self.baseFilename)
+            prefix = os.path.basename(self.baseFilename) + '.'
+            segments = []
+            try:
+                for name in os.listdir(logdir):
+                    if not name.startswith(prefix):
+                        continue
+                    if name.endswith('.tmp'): # a compression which was interrupted
+                        os.remove(os.path.join(logdir, name))
+                    elif name.endswith('.gz'):
+                        segments.append(name)
+                    else:
+                        segments.append(self._compress(os.path.join(logdir, name)))
+                segments.sort(key=lambda name: self._age(name[len(prefix):]))
+                for name in segments[:max(0, len(segments) - self.keep)]:
+                    os.remove(os.path.join(logdir, name))
+            except Exception as e:
+                logging.getLogger(__name__).warning('[CONFIG] Cleaning up the old log files failed. Reason: ' + str(e))
+
+    @staticmethod
+    def _compress(path):
+        ''' gzip a rotated log file, returns the new file name '''
+        with open(path, 'rb') as src, gzip.open(path + '.gz.tmp', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(path + '.gz.tmp', path + '.gz')
+        os.remove(path)
+        return os.path.basename(path) + '.gz'
+
+    @staticmethod
+    def _age(suffix):
+        ''' Sort key of a rotated log file. Files of earlier versions are numbered (higher is older) and older than all timestamped files. '''
+        suffix = suffix.removesuffix('.gz')
+        if suffix.isdigit():
+            return (0, -int(suffix), '', 0)
+        stamp, us = suffix[:15], suffix[16:] # YYYYmmdd-HHMMSS-ffffff
+        return (1, 0, stamp, int(us) if us.isdigit() else 0)
+
+
 def setupLogging():
-    ''' Sets up the logger, handles log files and different log levels for different handlers '''
+    ''' Sets up the logger, handles log files and different log levels for different handlers.
+    The logger only enqueues the records, the console, file and telegram handlers run on a background listener. Returns the logger and the listener. '''
     # Set up the logger with file and console handlers
     logger = logging.getLogger(__name__)
-    logger.setLevel(logging.DEBUG)
 
     # Create a console handler and set its level
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(os.getenv('CONSOLE_LOGGING_LEVEL'))
+    console_handler.setLevel(settings.console_logging_level)
     console_handler.setFormatter(logging.Formatter('[%(levelname)s] %(message)s'))
 
-    # handle old logfiles
-    logdir = os.path.dirname(os.getenv('LOG_FILE_PATH'))
-    basename = os.path.basename(os.getenv('LOG_FILE_PATH'))
-    os.makedirs(logdir, exist_ok=True)
-    pattern = r'^'+ basename + r'(?:.(\d+))?$'
-    oldLogs = [filename for filename in os.listdir(logdir) if re.match(pattern, filename)] # get all old logs
-    oldLogs = sorted(oldLogs,key=lambda name: int(re.match(pattern, name).group(1) if re.match(pattern, name).group(1) != None else 0)) # sort them by their number
-
-    for oldfile in reversed(oldLogs):
-        n = int(re.match(pattern, oldfile).group(1) if re.match(pattern, oldfile).group(1) != None else 0) # extract the number
-        if n >= int(os.getenv('KEEP_N_OLD_LOGS')): # number exeeds the max number, delete
-            os.remove(os.path.join(logdir, oldfile))
-        else: # increment the number
-            os.rename(os.path.join(logdir, oldfile),os.getenv('LOG_FILE_PATH') + '.' + str(n+1))
-        
-    # Create a file handler and set its level 
-    f = open(os.getenv('LOG_FILE_PATH'), "w", encoding='utf-8')
-    f.write('Win-Test Telegram Bot log file with Level: ' + os.getenv('FILE_LOGGING_LEVEL') + ', start time: ' + datetime.datetime.now().strftime('%d %b %Y, %H:%M:%S') + '\n')
-    f.close()
-    file_handler = logging.FileHandler(os.getenv('LOG_FILE_PATH'), mode='a', encoding='utf-8')
-    file_handler.setLevel(os.getenv('FILE_LOGGING_LEVEL'))
+    # Create a file handler and set its level, it rotates the old log files
+    file_handler = LogFileHandler(settings.log_file_path, settings.file_logging_level, settings.log_max_bytes, settings.log_rotate_hours * 3600, settings.keep_n_old_logs)
     file_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)s] %(message)s', datefmt='[%d.%m.%y %H:%M:%S]'))
 
-    # Add the handlers to the logger
-    logger.addHandler(console_handler)
-    logger.addHandler(file_handler)
-    return logger
-
-
-def newChat(chat_id, langcode=os.getenv('DEFAULT_LANG'), is_private=True, mute='own', user='', wt_confirm = (os.getenv('TG_CONFIRM_DEFAULT') == 'True'), tgTOtg=True, groupname = ''):
+    # Add the handlers to the listener, the logger only gets the queue
+    queueHandler = LogQueueHandler(queue.Queue(settings.log_queue_size))
+    queueHandler.addFilter(markDelivery)
+    listener = logging.handlers.QueueListener(queueHandler.queue, console_handler, file_handler, respect_handler_level=True)
+    logger.addHandler(queueHandler)
+    logger.setLevel(min(console_handler.level, file_handler.level)) # records below all handler levels are not even created
+    listener.start()
+    return logger, listener
+
+def addLogHandler(handler):
+    ''' Adds a handler to the logging listener. The handlers tuple is replaced as a whole, the listener thread never sees a partial update. '''
+    logListener.handlers = logListener.handlers + (handler,)
+    updateLogLevel()
+
+def removeLogHandler(handler):
+    ''' Removes a handler from the logging listener '''
+    logListener.handlers = tuple(h for h in logListener.handlers if h is not handler)
+    updateLogLevel()
+
+def updateLogLevel():
+    ''' Sets the level of the logger to the lowest level of all handlers. Call this whenever a handler level changes. '''
+    log.setLevel(min(handler.level for handler in logListener.handlers))
+
+def stopLogging():
+    ''' Processes the remaining log records and stops the listener. Called on exit. '''
+    dropped = log.handlers[0].dropped # the LogQueueHandler is the only handler of the logger
+    if dropped > 0:
+        log.warning('[CONFIG] The logging queue was full, ' + str(dropped) + ' log records were dropped.')
+    logListener.stop()
+
+
+@_locked
+def newChat(chat_id, langcode=settings.default_lang, is_private=True, mute=Mute.OWN, user='', wt_confirm = settings.tg_confirm_default, tgTOtg=True, groupname = ''):
     ''' If a new chat is started, we append it here to the database '''
 
     if user != '' and not users.get(user):
         log.warning('[CONFIG] Trying to create a new chat referencing a non-existing user. This is invalid, resetting user reference. ')
         user = ''
-    chats[chat_id] = {'langcode': langcode,
-                           'valid' : False,
-                           'mute' : mute,
-                           'is_private' : is_private,
-                           'user' : user,
-                           'wt_confirm' : wt_confirm,
-                           'tg_to_tg' : tgTOtg,
-                           'groupname' : groupname}
+    chat_id = sys.intern(chat_id)
+    old = chats.get(chat_id)
+    chats[chat_id] = Chat(langcode, False, mute, is_private, user, wt_confirm, tgTOtg, groupname)
+    _indexGroup(chat_id, old, chats[chat_id])
+    routes.updateChat(chat_id)
     log.debug('[CONFIG] New chat added to database')
-    storeDatabase()   
+    storeDatabase([chat_id])
 
+@_locked
 def newUser(username, wt_dispname = '', chat = '', log_level = 'none'):
     ''' Store all users interacting with the bot '''
 
     if chat != '' and not chats.get(chat):
         log.warning('[CONFIG] Trying to create a new user referencing a non-existing chat. This is invalid, resetting chat reference. ')
         chat = ''
-    users[username] = {'wt_dispname' : wt_dispname,
-                            'chat_id' : chat,
-                            'log_level' : log_level,
-                            'is_superuser' : False}
+    users[username] = User(wt_dispname, chat, log_level, False)
+    routes.updateUser(username)
     log.info('[CONFIG] New user ' + username + ' added to database')
-    storeDatabase()
+    storeDatabase(usernames=[username])
 
-def newPrivateChat(username, chat_id, langcode=os.getenv('DEFAULT_LANG'), mute='own', wt_dispname = '', log_level = 'none', wt_confirm = (os.getenv('TG_CONFIRM_DEFAULT') == 'True'), tgTOtg=True):
+@_locked
+def newPrivateChat(username, chat_id, langcode=settings.default_lang, mute=Mute.OWN, wt_dispname = '', log_level = 'none', wt_confirm = settings.tg_confirm_default, tgTOtg=True):
     ''' A private chat always consists of a chat-user pair cross referencing eachother. For this, we provide this function'''
-    users[username] = {'wt_dispname' : wt_dispname,
-                            'chat_id' : chat_id,
-                            'log_level' : log_level,
-                            'is_superuser' : False}
-    chats[chat_id] = {'langcode': langcode,
-                           'valid' : False,
-                           'mute' : mute,
-                           'is_private' : True,
-                           'user' : username,
-                           'wt_confirm' : wt_confirm,
-                           'tg_to_tg' : tgTOtg,
-                           'groupname' : ''}
+    chat_id = sys.intern(chat_id)
+    users[username] = User(wt_dispname, chat_id, log_level, False)
+    old = chats.get(chat_id)
+    chats[chat_id] = Chat(langcode, False, mute, True, username, wt_confirm, tgTOtg, '')
+    _indexGroup(chat_id, old, chats[chat_id])
+    routes.updateChat(chat_id)
     log.info('[CONFIG] New chat-user pair added to database. User:' + username)
-    storeDatabase()
+    storeDatabase([chat_id], [username])
 
+@_locked
 def remove(chat):
     ''' Removes data from a chat. If the chat is private, also all user data is deleted.'''
     if chats.get(chat) == None:
         log.error('[CONFIG] Chat to be deleted does not exist!')
         return
 
-    if chats[chat]['is_private'] == True:
-        user = chats[chat]['user']
+    user = ''
+    if chats[chat].is_private == True:
+        user = chats[chat].user
         log.info('[CONFIG] User ' + user + ' was removed.')
         users.pop(user)
-    chats.pop(chat)
+    _indexGroup(chat, chats.pop(chat), None)
+    routes.removeChat(chat)
     log.info('[CONFIG] Chat was removed.')
-    storeDatabase()
+    storeDatabase([chat], [user] if user != '' else ())
 
+@_locked
 def removeUser(user):
     ''' Deletes a specific user. If this user has a private chat, this one is deleted aswell. '''
     if users.get(user) == None:
         log.error('[CONFIG] User to be deleted does not exist!')
         return
     
-    if users[user]['chat_id'] != '':
-        remove(users[user]['chat_id'])
+    if users[user].chat_id != '':
+        remove(users[user].chat_id)
     else:
         log.info('[CONFIG] User ' + user + ' was removed.')
         users.pop(user)
-        storeDatabase()
+        storeDatabase(usernames=[user])
 
+@_locked
 def updateUser(user, key, value):
     ''' Update a specific user key-value pair. Not to be used for the logging level '''
     if users.get(user) == None:
@@ -288,28 +665,37 @@ def updateUser(user, key, value):
     if key == 'log_level':
         log.error('[CONFIG] Tried to set logging level via the update User Handler. This is not valid. Aborting.')
         return
-    users[user][key] = value
+    users[user] = dataclasses.replace(users[user], **{key : value}) # a new record, the published snapshots are never changed
+    routes.updateUser(user)
     log.debug('[CONFIG] User ' + user + ' got updated: ' + key + ' to ' + str(value))
-    storeDatabase()
+    storeDatabase(usernames=[user])
 
+@_locked
 def updateChat(chat, key, value):
     ''' Update a specific chat key-value pair.'''
     if chats.get(chat) == None:
         log.error('[CONFIG] Unable to find chat ' + chat)
         return
-    chats[chat][key] = value
+    old = chats[chat]
+    chats[chat] = dataclasses.replace(old, **{key : value}) # a new record, the published snapshots are never changed. Converts the mute setting, too
+    _indexGroup(chat, old, chats[chat])
+    routes.updateChat(chat)
     log.debug('[CONFIG] A Chat got updated: ' + key + ' to ' + str(value))
-    storeDatabase()
+    storeDatabase([chat])
 
+@_locked
 def updateUsername(oldUser, newUser):
     ''' Update the username in the data base. Fixing the double link (chatID <-> user) nedds to done seperatly. '''
     if users.get(oldUser) == None:
         log.error('[CONFIG] Cannot change username of non-existng user ' + oldUser)
         return
-    users[newUser] = users.pop(oldUser)
+    with users.edit() as data: # readers never see the user missing under both names
+        data[newUser] = data.pop(oldUser)
+    routes.updateUser(newUser)
     log.debug('[CONFIG] Changing user name from ' + oldUser + ' to ' + newUser)
-    storeDatabase()
+    storeDatabase(usernames=[oldUser, newUser])
 
+@_locked
 def updateUserLogging(user, loglevel, updateDatabase = True):
     ''' Update function for the user logging handler. In order to remove a logging handler set loglevel to 'none' '''
     if users.get(user) == None:
@@ -322,12 +708,12 @@ def updateUserLogging(user, loglevel, updateDatabase = True):
         except:
             log.warning('[CONFIG] Unable to compute log level.')
             return -1
-        telegramLogHandlers[user] = TelegramLoggingHandler(users[user]['chat_id'], ilevel)
-        log.addHandler(telegramLogHandlers[user])
+        telegramLogHandlers[user] = TelegramLoggingHandler(users[user].chat_id, ilevel)
+        addLogHandler(telegramLogHandlers[user])
         log.info('[CONFIG] Logging handler added for user ' + user)
     elif telegramLogHandlers.get(user) != None:
         if loglevel.lower() == 'none':
-            log.removeHandler(telegramLogHandlers[user])
+            removeLogHandler(telegramLogHandlers[user])
             telegramLogHandlers.pop(user)
             log.info('[CONFIG] Logging handler removed for user ' + user)
         else:
@@ -337,17 +723,18 @@ def updateUserLogging(user, loglevel, updateDatabase = True):
                 log.warning('[CONFIG] Unable to compute log level.')
                 return -1
             telegramLogHandlers[user].updateLevel(ilevel)
+            updateLogLevel()
             log.info('[CONFIG] Logging handler for user ' + user + ' updated to ' + loglevel)
     if updateDatabase:
-        users[user]['log_level'] = loglevel
-        storeDatabase()
+        users[user] = dataclasses.replace(users[user], log_level = loglevel)
+        storeDatabase(usernames=[user])
     return 0
 
 def setupTGHandlers():
     ''' After the user data is present, setup logging handlers from previous runs '''
     for user in users:
-        if users[user]['is_superuser'] == True and users[user]['log_level'] != 'none':
-            updateUserLogging(user,users[user]['log_level'], updateDatabase=False)
+        if users[user].is_superuser == True and users[user].log_level != 'none':
+            updateUserLogging(user,users[user].log_level, updateDatabase=False)
 
 def handleUncaughtException(exc_type, exc_value, exc_traceback):
     ''' Generic handler for all uncaught exceptions '''
@@ -364,20 +751,42 @@ def handleUncaughtException(exc_type, exc_value, exc_traceback):
 # Logging
 messageLogCallback = None # This needs to be set bevor initializing the Telegram logging handlers
 telegramLogHandlers = {} # Store the handlers 
-log = setupLogging()
+_logContext = threading.local() # per thread logging state, see markDelivery
+log, logListener = setupLogging()
+atexit.register(stopLogging) # registered first, so it runs last and gets the log records of the other exit handlers
 sys.excepthook = handleUncaughtException # store generic exception handler
 threading.excepthook = handleUncaughtException
 # Database
-chats, users = loadDatabase()
-chats, users, modified = checkDatabase(chats, users)
+_dbLock = threading.RLock() # held while the database is changed or serialized
+_dbFlushLock = threading.Lock() # held while the database file is written
+_dbDirty = False # there are changes which are not written yet
+_dbDirtyChats = set() # the chats and users with changes, None if everything changed
+_dbDirtyUsers = set()
+_dbTimer = None # the pending background write
+_dbTransactions = 0 # number of open transactions, writes are deferred until all of them ended
+if settings.database_backend == 'sqlite':
+    storage = SQLiteStorage(settings.database_sqlite_path, log)
+    storage.migrateFrom(JSONStorage(settings.database_file_path, log)) # one-shot, takes over the data of the JSON file on the first start
+else:
+    storage = JSONStorage(settings.database_file_path, log)
+atexit.register(closeDatabase) # never lose changes on exit
+chats, users, version = loadDatabase()
+modified = migrateDatabase(chats, users, version)
+# The handlers change the database while the Win-Test listener and the event loop read it, every change publishes a new snapshot
+chats = CowDict({sys.intern(chat) : Chat.fromDict(data) for chat, data in chats.items()})
+users = CowDict({user : User.fromDict(data) for user, data in users.items()})
+groups = {} # group name -> ids of the group chats with this name in the order they were added, kept up to date with the _dbLock held
+for chat, data in chats.items():
+    _indexGroup(chat, None, data)
 if modified:
     storeDatabase()
 
-del modified # free-up namespace, no longer needed
+del version, modified # free-up namespace, no longer needed
+routes = RoutingIndex(chats, users) # recipient sets for the message routing, kept up to date by the functions above
 
 # Multiple Languages:
-ml = MulitLanguageMessages(log) # load languages
-if not ml.languageSupported(os.getenv('DEFAULT_LANG')):
+ml = MulitLanguageMessages(log, settings.languagepack_path) # load languages
+if not ml.languageSupported(settings.default_lang):
     log.fatal('[CONFIG] The default language has no associated languagepack. Cannot operate this way.')
     quit()
 
@@ -0,0 +1,72 @@
+''' This file provides the record types of the database. On disk, the records are stored as plain dicts, toDict() and fromDict() convert between both forms. '''
+import dataclasses, enum, sys
+
+class Mute(str, enum.Enum):
+    ''' The mute setting of a chat. The members compare equal to their on-disk strings. '''
+    NONE = 'none' # receive all messages
+    OWN = 'own' # do not receive messages while the own user is operating
+    ALL = 'all' # do not receive any messages
+
+    __str__ = str.__str__ # print as 'own', not as 'Mute.OWN'
+    __format__ = str.__format__
+
+
+@dataclasses.dataclass(slots=True)
+class Chat:
+    ''' A private or group chat with this bot '''
+    langcode: str
+    valid: bool = False
+    mute: Mute = Mute.OWN
+    is_private: bool = True
+    user: str = '' # the user of a private chat
+    wt_confirm: bool = True
+    tg_to_tg: bool = True
+    groupname: str = '' # the title of a group chat
+    digest: bool = False # receive the Win-Test messages collected as digest
+    board: int = 0 # the message id of the status board, 0 if the chat has none
+
+    def __post_init__(self):
+        self.mute = Mute(self.mute)
+        self.user = sys.intern(self.user)
+
+    def toDict(self):
+        ''' Returns the on-disk form of this chat '''
+        return {'langcode' : self.langcode,
+                'valid' : self.valid,
+                'mute' : self.mute.value,
+                'is_private' : self.is_private,
+                'user' : self.user,
+                'wt_confirm' : self.wt_confirm,
+                'tg_to_tg' : self.tg_to_tg,
+                'groupname' : self.groupname,
+                'digest' : self.digest,
+                'board' : self.board}
+
+    @classmethod
+    def fromDict(cls, data):
+        ''' Creates a chat from its on-disk form. The data has to be migrated to the current schema already. '''
+        return cls(data['langcode'], data['valid'], data['mute'], data['is_private'], data['user'], data['wt_confirm'], data['tg_to_tg'], data['groupname'], data['digest'], data['board'])
+
+
+@dataclasses.dataclass(slots=True)
+class User:
+    ''' A Telegram user which interacted with this bot '''
+    wt_dispname: str = '' # the name shown in Win-Test, '' to use the username
+    chat_id: str = '' # the private chat with this user, '' if there is none
+    log_level: str = 'none'
+    is_superuser: bool = False
+
+    def __post_init__(self):
+        self.chat_id = sys.intern(self.chat_id)
+
+    def toDict(self):
+        ''' Returns the on-disk form of this user '''
+        return {'wt_dispname' : self.wt_dispname,
+                'chat_id' : self.chat_id,
+                'log_level' : self.log_level,
+                'is_superuser' : self.is_superuser}
+
+    @classmethod
+    def fromDict(cls, data):
+        ''' Creates a user from its on-disk form. The data has to be migrated to the current schema already. '''
+        return cls(data['wt_dispname'], data['chat_id'], data['log_level'], data['is_superuser'])
@@ -0,0 +1,166 @@
+''' This file provides the storage backends for the database. The chats and users are held in memory by BOTConfiguration, the backends persist their on-disk (dict) form.
+Writing is split in two steps: prepare() is called while the database is locked and takes what is needed, write() then does the I/O without the lock.
+prepare() gets the keys of the changed chats and users, None means everything changed. Both backends store the schema version of the data. '''
+import os, json, sqlite3, threading
+
+# The attributes of the records and their SQL types
+CHAT_COLUMNS = {'langcode' : 'TEXT',
+                'valid' : 'INTEGER',
+                'mute' : 'TEXT',
+                'is_private' : 'INTEGER',
+                'user' : 'TEXT',
+                'wt_confirm' : 'INTEGER',
+                'tg_to_tg' : 'INTEGER',
+                'groupname' : 'TEXT',
+                'digest' : 'INTEGER',
+                'board' : 'INTEGER'}
+USER_COLUMNS = {'wt_dispname' : 'TEXT',
+                'chat_id' : 'TEXT',
+                'log_level' : 'TEXT',
+                'is_superuser' : 'INTEGER'}
+BOOL_COLUMNS = {'valid', 'is_private', 'wt_confirm', 'tg_to_tg', 'digest', 'is_superuser'}
+
+
+class JSONStorage:
+    ''' Stores the whole database in a single JSON file. Every write replaces the file. '''
+
+    def __init__(self, path, log):
+        self.path = path
+        self.log = log
+        os.makedirs(os.path.dirname(self.path), exist_ok=True) # on first start, make sure all the paths are ok
+
+    def load(self):
+        ''' Returns chats, users and the schema version, None if there is no data yet. Files of earlier versions have no schema version, this is version 0. '''
+        try:
+            with open(self.path) as f:
+                data = json.loads(f.read())
+        except Exception:
+            return None
+        if data.get('chats') == None or data.get('users') == None: # check the format
+            return None
+        return data['chats'], data['users'], data.get('schema_version', 0)
+
+    def prepare(self, chats, users, dirtyChats, dirtyUsers, version):
+        return json.dumps({'schema_version' : version,
+                           'users' : {user : users[user].toDict() for user in users},
+                           'chats' : {chat : chats[chat].toDict() for chat in chats}})
+
+    def write(self, data):
+        ''' Writes to a temporary file first, then replaces the database file atomically '''
+        with open(self.path + '.tmp', 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + '.tmp', self.path)
+
+    def close(self):
+        pass
+
+
+class SQLiteStorage:
+    ''' Stores the database in SQLite, one row per chat and per user. Only changed rows are written. '''
+
+    def __init__(self, path, log):
+        self.path = path
+        self.log = log
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock() # the connection is shared by the writer thread and the event loop
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS chats (chat_id TEXT PRIMARY KEY)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._addColumns('chats', CHAT_COLUMNS)
+        self._addColumns('users', USER_COLUMNS)
+        for index in ('chats_groupname', 'chats_mute', 'chats_valid', 'users_wt_dispname'): # of earlier versions, all lookups use the data in memory
+            self._db.execute('DROP INDEX IF EXISTS ' + index)
+
+    def _addColumns(self, table, columns):
+        ''' Adds the columns which are missing in an existing database '''
+        existing = {row[1] for row in self._db.execute('PRAGMA table_info(' + table + ')')}
+        for column, sqlType in columns.items():
+            if column not in existing:
+                self._db.execute('ALTER TABLE ' + table + ' ADD COLUMN "' + column + '" ' + sqlType)
+
+    def load(self):
+        ''' Returns chats, users and the schema version, None if the database is empty '''
+        with self._lock:
+            chats = self._loadTable('chats', 'chat_id', CHAT_COLUMNS)
+            users = self._loadTable('users', 'username', USER_COLUMNS)
+        if not chats and not users:
+            return None
+        return chats, users, int(self.getMeta('schema_version') or 0)
+
+    def _loadTable(self, table, key, columns):
+        names = list(columns)
+        data = {}
+        for row in self._db.execute('SELECT ' + key + ', ' + ', '.join('"' + name + '"' for name in names) + ' FROM ' + table):
+            record = {}
+            for name, value in zip(names, row[1:]):
+                if value == None: # a column added after this row was written, the schema migration fills in the default
+                    continue
+                record[name] = bool(value) if name in BOOL_COLUMNS else value
+            data[row[0]] = record
+        return data
+
+    def prepare(self, chats, users, dirtyChats, dirtyUsers, version):
+        ''' Copy the changed rows, None marks a removed row. If everything changed, all rows are copied and the tables are rewritten. '''
+        replace = dirtyChats == None or dirtyUsers == None
+        if replace:
+            dirtyChats = chats
+            dirtyUsers = users
+        return (replace, version,
+                [(chat, chats[chat].toDict() if chat in chats else None) for chat in dirtyChats],
+                [(user, users[user].toDict() if user in users else None) for user in dirtyUsers])
+
+    def write(self, data):
+        ''' Applies the changed rows in a single transaction '''
+        replace, version, chatRows, userRows = data
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                if replace:
+                    self._db.execute('DELETE FROM chats')
+                    self._db.execute('DELETE FROM users')
+                self._db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ('schema_version', str(version)))
+                self._writeRows('chats', 'chat_id', CHAT_COLUMNS, chatRows)
+                self._writeRows('users', 'username', USER_COLUMNS, userRows)
+                self._db.execute('COMMIT')
+            except:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def _writeRows(self, table, key, columns, rows):
+        names = list(columns)
+        upsert = ('INSERT OR REPLACE INTO ' + table + ' (' + key + ', ' + ', '.join('"' + name + '"' for name in names) + ') VALUES (' + ', '.join('?' * (len(names) + 1)) + ')')
+        for rowKey, record in rows:
+            if record == None:
+                self._db.execute('DELETE FROM ' + table + ' WHERE ' + key + ' = ?', (rowKey,))
+            else:
+                self._db.execute(upsert, [rowKey] + [record.get(name) for name in names])
+
+    def getMeta(self, key):
+        with self._lock:
+            row = self._db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def setMeta(self, key, value):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def migrateFrom(self, source):
+        ''' One-shot import of the data of another storage, e.g. the JSON file of earlier versions. Does nothing if it was done before. '''
+        if self.getMeta('migrated_from') != None:
+            return False
+        data = source.load()
+        if data != None:
+            chats, users, version = data
+            self.write((True, version, list(chats.items()), list(users.items()))) # keep the version, the data is migrated after loading
+            self.log.info('[DB] Migrated ' + str(len(chats)) + ' chats and ' + str(len(users)) + ' users from ' + source.path)
+        self.setMeta('migrated_from', source.path)
+        return data != None
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,125 @@
+''' This file provides the digest mode. Win-Test messages for chats in digest mode are collected for a short window and sent as one message
+with a section per station, instead of one Telegram message per Win-Test message. '''
+import threading
+from MuliLanguageMessages import escapeMarkdown
+
+
+class MessageDigest:
+    ''' Collects messages for TG_DIGEST_WINDOW seconds, or until a Telegram message is full. Every message is added with the set of chats which
+    shall receive it. On flush, all chats which received the same messages share a single composed text, which is split at Telegram's length limit. '''
+
+    MAX_LENGTH = 4096 # max. length of a Telegram message, after escaping
+
+    def __init__(self, window, sendHandler):
+        ''' `sendHandler` is called with (chatIDs, text) for every composed digest, e.g. TelegramChatManager.broadcastMessage '''
+        self.window = window
+        self._send = sendHandler
+        self._lock = threading.Lock() # messages are added by the Win-Test listener, the timer flushes them
+        self._entries = [] # (station header, message, recipients) in the order they arrived
+        self._headers = set() # the stations with buffered messages
+        self._length = 0 # escaped length of all buffered messages, a digest is sent early instead of exceeding a single Telegram message
+        self._timer = None
+        self._closed = False # set by close(), later messages are sent at once
+
+    def add(self, header, message, recipients):
+        ''' Buffer a message of a station. `header` names the station (and its operator), `recipients` is the set of chats in digest mode which receive it. '''
+        if not recipients:
+            return
+        lineLength = len(escapeMarkdown(message)) + 1 # the newline before the message
+        headerLength = len(escapeMarkdown(header)) + 3 # ':' and the blank line before the section
+        full = None
+        with self._lock:
+            if self._closed: # shutting down, no timer would send it: send it alone
+                full = [(header, message, recipients)]
+            else:
+                length = lineLength if header in self._headers else lineLength + headerLength
+                if self._entries and self._length + length > self.MAX_LENGTH: # this message would not fit anymore, send the others first
+                    full = self._take()
+                    length = lineLength + headerLength
+                self._entries.append((header, message, recipients))
+                self._headers.add(header)
+                self._length += length
+                if self._timer == None: # the first message of this window
+                    self._timer = threading.Timer(self.window, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+        if full != None:
+            self._sendEntries(full)
+
+    def flush(self):
+        ''' Send the buffered messages '''
+        with self._lock:
+            entries = self._take()
+        self._sendEntries(entries)
+
+    def _take(self):
+        ''' Returns the buffered messages and starts a new window. Called with the lock held. '''
+        if self._timer != None:
+            self._timer.cancel()
+            self._timer = None
+        entries = self._entries
+        self._entries = []
+        self._headers = set()
+        self._length = 0
+        return entries
+
+    def _sendEntries(self, entries):
+        ''' Chats which receive the same messages get the same digest, it is composed only once '''
+        if not entries:
+            return
+
+        received = {} # chat -> indices of the entries it receives
+        for i, (_, _, recipients) in enumerate(entries):
+            for chat in recipients:
+                received.setdefault(chat, []).append(i)
+        groups = {} # indices of the entries -> chats receiving exactly these
+        for chat, indices in received.items():
+            groups.setdefault(tuple(indices), []).append(chat)
+        for indices, chats in groups.items():
+            for text in self.compose([entries[i] for i in indices]):
+                self._send(chats, text)
+
+    def compose(self, entries):
+        ''' Build the digest texts, one section per station in the order the stations first appeared. Returns a list of texts, each fits into a single Telegram message. '''
+        sections = {} # header -> messages
+        for header, message, _ in entries:
+            sections.setdefault(header, []).append(message)
+        texts = []
+        text = ''
+        length = 0
+        for header, messages in sections.items():
+            for section, sectionLength in self._sections(header, messages):
+                if text != '' and length + 2 + sectionLength > self.MAX_LENGTH: # does not fit anymore, start the next message
+                    texts.append(text)
+                    text = ''
+                    length = 0
+                if text != '':
+                    text += '\n\n'
+                    length += 2
+                text += section
+                length += sectionLength
+        if text != '':
+            texts.append(text)
+        return texts
+
+    def _sections(self, header, messages):
+        ''' Yields the section of a station and its escaped length. If the section is too long for a single Telegram message, it is split between the messages
+        and the header is repeated. '''
+        section = header + ':'
+        length = empty = len(escapeMarkdown(section))
+        for message in messages:
+            lineLength = 1 + len(escapeMarkdown(message)) # newlines are not escaped
+            if length != empty and length + lineLength > self.MAX_LENGTH:
+                yield section, length
+                section = header + ':'
+                length = empty
+            section += '\n' + message
+            length += lineLength
+        yield section, length
+
+    def close(self):
+        ''' Send what is left, no more messages are buffered after this: later messages are sent one by one at once '''
+        with self._lock:
+            self._closed = True
+            entries = self._take()
+        self._sendEntries(entries)
@@ -0,0 +1,223 @@
+import BOTConfiguration as cf
+import asyncio, collections, concurrent.futures, heapq, itertools, random, datetime, time
+import telegram, httpx
+
+class TokenBucket:
+    ''' A simple token bucket. It holds up to `capacity` tokens and is refilled with `rate` tokens per second. '''
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'stamp')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = now
+
+    def delay(self, now):
+        ''' Returns the time in seconds until a token is available. 0 if a token can be taken right now. '''
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        ''' Takes a token. Only call this after delay() returned 0. '''
+        self.tokens -= 1
+
+
+class MessageDispatcher:
+    ''' This class provides the outbound delivery engine for Telegram messages. Messages are queued per chat and released by token buckets
+    which follow the Telegram rate limits (globally, per chat and per group). Enqueuing is thread-safe and never blocks the caller.
+    Failed deliveries are retried: flood control (RetryAfter) pauses all sending for the requested time, transient network errors are retried
+    with jittered exponential backoff. Permanent errors (e.g. BadRequest, Forbidden) drop the message. Messages of a chat are delivered in order.
+    Messages queued with a time to live are written to the spool first. They are retried until they expire, even while there is no internet connection,
+    and resent after a restart. '''
+
+    GLOBAL_RATE = 30 # messages per second over all chats
+    CHAT_RATE = 1 # messages per second into a single chat
+    GROUP_RATE = 20 / 60 # messages per second into a group chat, this is 20 messages per minute
+    GROUP_BURST = 20 # a group may receive this many messages at once (within the chat rate) before the group rate kicks in
+    MAX_ATTEMPTS = 5 # a message is dropped after this many failed attempts
+    BACKOFF_BASE = 1 # seconds to wait before the first retry, doubled for every further retry
+    BACKOFF_MAX = 60 # max. seconds between two attempts
+
+    def __init__(self, loop, sendHandler, spool = None):
+        ''' Setup the dispatcher. `loop` is the event loop the dispatcher will run on, `sendHandler` is the coroutine function (chatID, message, edit) which actually sends a message,
+        or edits the message with the id `edit` if it is not None.
+        `spool` is the MessageSpool for messages with a time to live, None to keep all messages in memory only. '''
+        self._loop = loop
+        self._send = sendHandler
+        self._spool = spool
+        self._global = None # the global bucket, created as soon as we know the loop time
+        self._buckets = {} # chatID -> tuple of buckets which apply to this chat
+        self._queues = {} # chatID -> deque of pending messages for this chat
+        self._schedule = [] # heap of (time at which the chat may send again, seq, chatID) for all chats with pending messages
+        self._seq = itertools.count() # tie-breaker for the heap, keeps the order for chats ready at the same time
+        self._wakeup = None
+        self._tasks = set() # keep references to running deliveries, otherwise they could be garbage collected
+        self._task = None
+        self._busy = set() # chats with a delivery in flight, they are scheduled again when it is done
+        self._pausedUntil = 0 # loop time until which nothing is sent, set by flood control
+        self.delivered = 0 # statistics
+        self.retried = 0
+        self.dropped = 0
+        self.expired = 0
+
+    def start(self):
+        ''' Schedules the dispatcher on its event loop and queues the messages left in the spool by the last run. The loop does not need to run yet. '''
+        self._task = self._loop.create_task(self.run())
+        if self._spool != None:
+            for entry in self._spool.load():
+                self._loop.call_soon_threadsafe(self._push, entry['chat'], entry['msg'], concurrent.futures.Future(), entry, None)
+
+    def enqueue(self, chatID, message, ttl = None, edit = None):
+        ''' Queue a message for the given chat. This can be called from any thread and returns immediately.
+        With a `ttl` (in seconds), the message is spooled and dropped if it could not be sent within this time.
+        With an `edit` message id, the text of this message is replaced instead of sending a new one. Edits count against the same rate limits.
+        Returns a concurrent.futures.Future which is resolved as soon as the message was handed to Telegram. '''
+        future = concurrent.futures.Future()
+        entry = None
+        if ttl != None and self._spool != None:
+            entry = self._spool.append(chatID, message, ttl)
+        try:
+            self._loop.call_soon_threadsafe(self._push, chatID, message, future, entry, edit)
+        except RuntimeError: # the loop is already closed, a spooled message is sent on the next start
+            cf.log.warning('[DSP] Event loop closed, message dropped.')
+            future.cancel()
+        return future
+
+    def pending(self):
+        ''' Number of messages waiting to be sent '''
+        return sum(len(queue) for queue in self._queues.values())
+
+    def logStatistics(self):
+        cf.log.info('[DSP] Messages delivered: %d, retried: %d, dropped: %d, expired: %d, still pending: %d', self.delivered, self.retried, self.dropped, self.expired, self.pending())
+
+    def _push(self, chatID, message, future, entry, edit):
+        ''' Runs on the loop. Append the message to the chat queue and schedule the chat if it is idle. '''
+        queue = self._queues.get(chatID)
+        if queue == None:
+            queue = self._queues[chatID] = collections.deque()
+        queue.append((message, future, 1, entry, edit))
+        if len(queue) == 1 and chatID not in self._busy: # the chat was idle, it may send as soon as its buckets allow it
+            self._scheduleChat(chatID, 0)
+
+    def _scheduleChat(self, chatID, delay):
+        ''' Runs on the loop. The chat may send its next message after `delay` seconds, or later if its buckets do not allow it yet. '''
+        now = self._loop.time()
+        heapq.heappush(self._schedule, (now + max(delay, self._chatDelay(chatID, now)), next(self._seq), chatID))
+        if self._wakeup != None:
+            self._wakeup.set()
+
+    def _chatBuckets(self, chatID, now):
+        ''' Get or create the buckets for a chat. Group chats have negative IDs in Telegram and are limited additionally. '''
+        buckets = self._buckets.get(chatID)
+        if buckets == None:
+            if str(chatID).startswith('-'):
+                buckets = (TokenBucket(self.CHAT_RATE, 1, now), TokenBucket(self.GROUP_RATE, self.GROUP_BURST, now))
+            else:
+                buckets = (TokenBucket(self.CHAT_RATE, 1, now),)
+            self._buckets[chatID] = buckets
+        return buckets
+
+    def _chatDelay(self, chatID, now):
+        return max(bucket.delay(now) for bucket in self._chatBuckets(chatID, now))
+
+    async def run(self):
+        ''' The dispatcher main loop. Picks the chat which may send next and hands one message at a time to the send handler. '''
+        self._wakeup = asyncio.Event()
+        self._global = TokenBucket(self.GLOBAL_RATE, self.GLOBAL_RATE, self._loop.time())
+        cf.log.debug('[DSP] Message dispatcher started')
+        while True:
+            if not self._schedule: # nothing to do, sleep until something is queued
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            now = self._loop.time()
+            readyAt, _, chatID = self._schedule[0]
+            wait = max(readyAt - now, self._global.delay(now), self._pausedUntil - now)
+            if wait > 0: # wait for the next free slot, a newly queued message may be ready earlier
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._schedule)
+            wait = self._chatDelay(chatID, now) # the buckets may have been used up in the meantime
+            if wait > 0:
+                heapq.heappush(self._schedule, (now + wait, next(self._seq), chatID))
+                continue
+
+            queue = self._queues[chatID]
+            message, future, attempt, entry, edit = queue.popleft()
+            if not queue:
+                self._queues.pop(chatID)
+            if entry != None and entry['expires'] < time.time(): # stale, e.g. after a long loss of the internet connection
+                self.expired += 1
+                self._drop(future, TimeoutError('Message expired'), entry)
+                if queue:
+                    self._scheduleChat(chatID, 0)
+                continue
+            self._global.take()
+            for bucket in self._buckets[chatID]:
+                bucket.take()
+            self._busy.add(chatID) # the chat is scheduled again when the delivery is done, this keeps the order of its messages
+
+            task = self._loop.create_task(self._deliver(chatID, message, future, attempt, entry, edit))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, chatID, message, future, attempt, entry, edit):
+        ''' Send a single message and resolve its future. On failure, the message is put back to the front of its chat queue or dropped. '''
+        retryIn = None # seconds until the next attempt, None if the message is done
+        error = None
+        try:
+            await self._send(chatID, message, edit)
+            self.delivered += 1
+            if entry != None:
+                self._spool.ack(entry)
+            if not future.done():
+                future.set_result(True)
+        except telegram.error.RetryAfter as e: # flood control, Telegram tells us exactly how long to wait
+            error = e
+            retryIn = e.retry_after.total_seconds() if isinstance(e.retry_after, datetime.timedelta) else e.retry_after
+            self._pausedUntil = max(self._pausedUntil, self._loop.time() + retryIn) # pause all chats, not only this one
+            cf.log.warning('[DSP] Flood control, pausing all messages for %s seconds.', retryIn, extra={'telegram_delivery': True})
+        except (telegram.error.BadRequest, telegram.error.Forbidden, telegram.error.InvalidToken, telegram.error.ChatMigrated) as e: # permanent, retrying would not help. BadRequest is a NetworkError, it has to be caught first
+            cf.log.warning('[DSP] The message could not be sent, dropped. Reason: %s', e, extra={'telegram_delivery': True})
+            self._drop(future, e, entry)
+        except (telegram.error.NetworkError, httpx.HTTPError) as e: # transient, including TimedOut and connection errors
+            error = e
+            retryIn = min(self.BACKOFF_MAX, self.BACKOFF_BASE * 2 ** (attempt - 1))
+            retryIn = retryIn / 2 + random.uniform(0, retryIn / 2) # jitter, so the chats do not retry all at once
+            cf.log.debug('[DSP] Failed to send a message (attempt %d), retrying in %.1f seconds. Reason: %s', attempt, retryIn, e, extra={'telegram_delivery': True})
+        except Exception as e:
+            cf.log.error('[DSP] Unexpected error while sending a message, dropped. Reason: %s', e, exc_info=e, extra={'telegram_delivery': True})
+            self._drop(future, e, entry)
+
+        if retryIn != None:
+            if attempt >= self.MAX_ATTEMPTS and entry == None: # spooled messages are retried until they expire
+                cf.log.warning('[DSP] The message could not be sent after %d attempts, dropped.', attempt, extra={'telegram_delivery': True})
+                self._drop(future, error, entry)
+                retryIn = None
+            else:
+                self.retried += 1
+                queue = self._queues.get(chatID)
+                if queue == None:
+                    queue = self._queues[chatID] = collections.deque()
+                queue.appendleft((message, future, attempt + 1, entry, edit))
+
+        self._busy.discard(chatID)
+        if chatID in self._queues:
+            self._scheduleChat(chatID, retryIn or 0)
+
+    def _drop(self, future, error, entry):
+        self.dropped += 1
+        if entry != None:
+            self._spool.ack(entry)
+        if not future.done():
+            future.set_exception(error)
@@ -0,0 +1,130 @@
+''' This file provides the outbound spool. Messages which have to survive a loss of the internet connection or a restart of the bot are written
+to the spool before they are queued and acknowledged as soon as they are delivered, dropped or expired. '''
+import os, json, time, threading, itertools
+
+
+class MessageSpool:
+    ''' An append-only JSON-lines file. Every line is either a message {"id", "chat", "msg", "expires"} or an acknowledgement {"ack"}.
+    Appending only writes into the file buffer, the file is synced at most every SYNC_INTERVAL seconds. Acknowledged messages are removed by rewriting the file.
+    Syncing and rewriting run on the timer thread without the lock, appending (e.g. on the event loop) never waits for the disk. '''
+
+    SYNC_INTERVAL = 1 # seconds, max. time a message may be lost by a crash
+    COMPACT_MIN = 1000 # rewrite the file once it holds this many acknowledged messages and they outnumber the pending ones
+
+    def __init__(self, path, log):
+        self.path = path
+        self.log = log
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock() # messages are appended by the Win-Test listener and acknowledged by the event loop
+        self._syncLock = threading.Lock() # one sync or rewrite at a time, the file is not closed while it is synced
+        self._pending = {} # id -> message entry, in the order they were appended
+        self._acked = 0 # acknowledged messages still in the file
+        self._ids = itertools.count(1)
+        self._file = None
+        self._timer = None
+        self._compactWanted = False # set by ack(), the next sync rewrites the file
+        self._tail = None # lines written while the file is rewritten, they are appended to the new file
+
+    def load(self):
+        ''' Reads the spool left by the last run and returns the messages which were neither acknowledged nor expired, in order.
+        The file is rewritten with just these messages. Has to be called once before appending. '''
+        pending = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError: # the last line may be incomplete after a crash
+                        continue
+                    if 'ack' in entry:
+                        pending.pop(entry['ack'], None)
+                    else:
+                        pending[entry['id']] = entry
+        except FileNotFoundError:
+            pass
+        now = time.time()
+        with self._lock:
+            self._pending = {id : entry for id, entry in pending.items() if entry['expires'] > now}
+            self._ids = itertools.count(max(pending, default = 0) + 1)
+        with self._syncLock:
+            self._rewrite(list(self._pending.values()))
+        if pending:
+            self.log.info('[SPL] Spool loaded, ' + str(len(self._pending)) + ' messages to resend, ' + str(len(pending) - len(self._pending)) + ' expired')
+        return list(self._pending.values())
+
+    def append(self, chatID, message, ttl):
+        ''' Spools a message for the given chat, it expires after `ttl` seconds. Returns the entry which has to be acknowledged later. '''
+        with self._lock:
+            entry = {'id' : next(self._ids), 'chat' : chatID, 'msg' : message, 'expires' : time.time() + ttl}
+            self._pending[entry['id']] = entry
+            self._write(entry)
+        return entry
+
+    def ack(self, entry):
+        ''' Marks a message as done, it will not be resent '''
+        with self._lock:
+            if self._pending.pop(entry['id'], None) == None or self._file == None:
+                return
+            self._acked += 1
+            self._write({'ack' : entry['id']})
+            if self._acked >= self.COMPACT_MIN and self._acked > len(self._pending):
+                self._compactWanted = True # done by the next sync, which is scheduled by the write above
+
+    def _write(self, entry):
+        ''' Called with the lock held '''
+        if self._file == None: # closed already
+            return
+        line = json.dumps(entry) + '\n'
+        self._file.write(line)
+        if self._tail != None: # the file is being rewritten, the new file needs this line as well
+            self._tail.append(line)
+        if self._timer == None: # the first write since the last sync, the following ones are synced together
+            self._timer = threading.Timer(self.SYNC_INTERVAL, self.sync)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def sync(self):
+        ''' Writes the buffered lines to disk and rewrites the file if many messages are acknowledged. Runs on the timer thread. '''
+        with self._syncLock:
+            with self._lock: # only hand the lines to the OS, the slow part runs without the lock
+                self._timer = None
+                if self._file == None:
+                    return
+                self._file.flush()
+                fd = self._file.fileno() # stays open, closing needs the sync lock
+                pending = None
+                if self._compactWanted:
+                    self._compactWanted = False
+                    self._acked = 0
+                    self._tail = []
+                    pending = list(self._pending.values())
+            os.fsync(fd)
+            if pending != None:
+                self._rewrite(pending)
+
+    def _rewrite(self, pending):
+        ''' Writes the pending messages to a new file and replaces the spool with it. Called with the sync lock held, not with the lock. '''
+        f = open(self.path + '.tmp', 'w', encoding='utf-8')
+        for entry in pending:
+            f.write(json.dumps(entry) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+        with self._lock: # switch to the new file, with the lines written in the meantime
+            f.writelines(self._tail or ())
+            self._tail = None
+            if self._file != None:
+                self._file.close()
+            os.replace(self.path + '.tmp', self.path)
+            self._file = f
+
+    def close(self):
+        ''' Syncs and closes the file, the pending messages are resent on the next start '''
+        with self._syncLock, self._lock:
+            if self._timer != None:
+                self._timer.cancel()
+                self._timer = None
+            if self._file != None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self._file.close()
+                self._file = None
@@ -1,58 +1,117 @@
-import os, json
+import os, json, re
+
+# A placeholder for a variable, e.g. [name]. Upper case brackets like [SECRET KEY] or choices like [on|off] are literal text.
+PLACEHOLDER_REGEX = re.compile(r'\[([a-z_]+)\]')
+# The characters which have to be escaped in Telegram's MarkdownV2, same as telegram.helpers.escape_markdown(version=2) but compiled only once
+MARKDOWN_REGEX = re.compile(r'([\\_*\[\]()~`>#+\-=|{}.!])')
+
+def escapeMarkdown(text):
+    ''' Escapes a text for Telegram's MarkdownV2 '''
+    return MARKDOWN_REGEX.sub(r'\\\1', text)
+
+class MessageTemplate:
+    ''' A message compiled at load time. The text is split into literal parts and placeholders, rendering just fills in the placeholders and joins the parts.
+    The parts are also kept escaped for Telegram's MarkdownV2, so only the variables need to be escaped when rendering for Telegram. '''
+
+    __slots__ = ('text', 'parts', 'slots', 'names', 'markdown', 'markdownParts')
+
+    def __init__(self, text):
+        self.text = text
+        self.parts = PLACEHOLDER_REGEX.split(text) # literal, name, literal, name, ..., literal
+        self.slots = tuple((i, self.parts[i]) for i in range(1, len(self.parts), 2)) # index and name of every placeholder
+        for i, name in self.slots:
+            self.parts[i] = '[' + name + ']' # if a variable is not given, the placeholder stays in the message
+        self.names = frozenset(name for _, name in self.slots)
+        self.markdown = escapeMarkdown(text) # escaping works character by character, escaping the parts is the same as escaping the whole text
+        self.markdownParts = [escapeMarkdown(part) for part in self.parts]
+
+    def render(self, vars = None):
+        ''' Returns the message with the given variables filled in. Variables which are not used by this message are ignored. '''
+        if not vars or not self.slots:
+            return self.text
+        parts = self.parts.copy()
+        for i, name in self.slots:
+            if name in vars:
+                parts[i] = str(vars[name])
+        return ''.join(parts)
+
+    def renderMarkdown(self, vars = None):
+        ''' Same as render(), but returns the message escaped for MarkdownV2 '''
+        if not vars or not self.slots:
+            return self.markdown
+        parts = self.markdownParts.copy()
+        for i, name in self.slots:
+            if name in vars:
+                parts[i] = escapeMarkdown(str(vars[name]))
+        return ''.join(parts)
+
 
 class MulitLanguageMessages:
     ''' This class provides easy handlers to acess the multi language messages. The languagefiles are stored in the json format, the path is defined in .env LANGUAGEPACK_PATH '''
 
-    langDir = os.getenv('LANGUAGEPACK_PATH')
 
+    def __init__(self, log, langDir):
+        ''' Constructor which will load and compile all present files and messages '''
 
-    def __init__(self, log):
-        ''' Constructor which will load all present files and messages '''
-
-        self.MESSAGES = {} # Stores all messages of all languages
-        self.log = log # store the logging object 
-        for filename in os.listdir(MulitLanguageMessages.langDir): # just read every json file in the lang file
+        self.MESSAGES = {} # Stores all messages of all languages, as MessageTemplate
+        self.log = log # store the logging object
+        self.langDir = langDir
+        for filename in os.listdir(self.langDir): # just read every json file in the lang file
             if filename.endswith('.json'):
                 langcode = filename.split('.')[0] # NOTE: This forbids language codes to contain a dot.
                 langcode = langcode.lower() # DEFINE: Langcodes are lowercase
-                with open(os.path.join(MulitLanguageMessages.langDir, filename), 'r', encoding='utf-8') as f:
+                with open(os.path.join(self.langDir, filename), 'r', encoding='utf-8') as f:
                     messages = json.loads(f.read())
-                    self.MESSAGES[langcode] = messages
-                    
+                    self.MESSAGES[langcode] = {msg_id : MessageTemplate(text) for msg_id, text in messages.items()}
+
                 self.log.info('[ML] Languagepack read: ' + langcode)
+        self.checkLanguagepacks()
+
+    def checkLanguagepacks(self):
+        ''' Compares the languagepacks with each other. Every language has to provide all messages with the same variables, otherwise a warning is logged once. '''
+        msg_ids = set()
+        for messages in self.MESSAGES.values():
+            msg_ids.update(messages)
+        for msg_id in sorted(msg_ids):
+            names = set()
+            for messages in self.MESSAGES.values():
+                if messages.get(msg_id) != None:
+                    names.update(messages[msg_id].names)
+            for langcode, messages in self.MESSAGES.items():
+                if messages.get(msg_id) == None:
+                    self.log.warning('[ML] The Message-ID ' + msg_id + ' is not present in the languagepack ' + langcode)
+                elif messages[msg_id].names != names:
+                    self.log.warning('[ML] The variables ' + ', '.join(sorted(names - messages[msg_id].names)) + ' are not present in the message-id ' + msg_id + ' of languagepack ' + langcode)
 
     def getMessage(self, langcode, msg_id, vars = None):
         ''' This function finds and builds the requested message of the requestes language. Via the vars dict you can replace an arbitrary amount of parameters in the messages. '''
-
-        # sanity checks
-        if not self.MESSAGES.get(langcode):
-            self.log.error('[ML] The requested languagecode is not available: ' + langcode)
-            return '[ERROR] The requested languagecode is not available: ' + langcode
-        
-        if not self.MESSAGES[langcode].get(msg_id):
+        try:
+            template = self.MESSAGES[langcode][msg_id]
+        except KeyError: # sanity checks, only done if something is missing
+            if not self.MESSAGES.get(langcode):
+                self.log.error('[ML] The requested languagecode is not available: ' + langcode)
+                return '[ERROR] The requested languagecode is not available: ' + langcode
             self.log.error('[ML] The requested Message-ID ('+ msg_id + ') is not present in the languagepack ' + langcode + '!')
             return '[ERROR] The requested Message-ID ('+ msg_id + ') is not present in the languagepack ' + langcode + '!'
 
-        # extract message
-        message = self.MESSAGES[langcode][msg_id]
-        
-        # replace parameters
-        if vars:
-            for key, value in vars.items():
-                if f"[{key}]" not in message:
-                    self.log.warning('[ML] The variable ' + key + ' is not present in the message-id ' + msg_id + ' of languagepack ' + langcode)
-                else:
-                    message = message.replace(f"[{key}]", str(value))
-        
-        return message
+        return template.render(vars)
+
+    def getMarkdown(self, langcode, msg_id, vars = None):
+        ''' Same as getMessage(), but returns the message escaped for Telegram's MarkdownV2. Messages without variables are escaped only once, at load time. '''
+        try:
+            template = self.MESSAGES[langcode][msg_id]
+        except KeyError:
+            return escapeMarkdown(self.getMessage(langcode, msg_id, vars)) # logs the error
+
+        return template.renderMarkdown(vars)
 
     def languageSupported(self, langcode):
         ''' Simple check weather a language code exists'''
         return self.MESSAGES.get(langcode) != None
-    
+
     def getLanguagesString(self):
         ''' Restruns a string with all supported langages'''
         msg = ''
         for lang in self.MESSAGES:
-            msg += lang + ': ' + self.MESSAGES[lang]['LANGUAGE'] + '\n'
-        return msg
\ No newline at end of file
+            msg += lang + ': ' + self.MESSAGES[lang]['LANGUAGE'].text + '\n'
+        return msg
@@ -0,0 +1,51 @@
+import threading
+from SharedState import CowDict
+
+class OperatorIndex:
+    ''' This class keeps track of the Win-Test stations and the operators logged in to them. Callsigns are normalized to upper case.
+    Both indexes are copy-on-write, so readers on other threads never need a lock. '''
+
+    def __init__(self):
+        self._lock = threading.Lock() # serializes the writers, the two indexes are changed together
+        self._stations = CowDict() # station -> call of the operator as sent by Win-Test, '' if nobody is logged in
+        self._byCall = CowDict() # call (upper case) -> frozenset of stations this operator is logged in to
+
+    def setOperator(self, station, call = ''):
+        ''' Log an operator in to a station. To log out the current operator of a station, leave the call empty. Returns the previous call. '''
+        with self._lock:
+            oldCall = self._stations.get(station, '')
+            with self._byCall.edit() as byCall:
+                if oldCall != '':
+                    remaining = byCall.get(oldCall.upper(), frozenset()) - {station}
+                    if remaining:
+                        byCall[oldCall.upper()] = remaining
+                    else:
+                        byCall.pop(oldCall.upper(), None)
+                if call != '':
+                    byCall[call.upper()] = byCall.get(call.upper(), frozenset()) | {station}
+            self._stations[station] = call
+        return oldCall
+
+    def isOperating(self, call):
+        ''' Checks weather the given callsign is currently logged in to any station '''
+        return call.upper() in self._byCall
+
+    def stationsOf(self, call):
+        ''' Returns the stations the given callsign is logged in to '''
+        return self._byCall.get(call.upper(), frozenset())
+
+    def operators(self):
+        ''' Returns the callsigns (upper case) of all operators which are currently logged in '''
+        return self._byCall.keys()
+
+    def getOperator(self, station):
+        ''' Returns the operator of a station, '' if nobody is logged in or the station is unknown '''
+        return self._stations.get(station, '')
+
+    def knows(self, station):
+        ''' Checks weather we have seen this station before '''
+        return station in self._stations
+
+    def stations(self):
+        ''' Returns the station -> operator mapping. The returned dict is a snapshot, it is never changed and must not be modified. '''
+        return self._stations.snapshot()
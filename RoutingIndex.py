@@ -0,0 +1,152 @@
+import threading
+from DatabaseRecords import Mute
+
+MUTE_NONE, MUTE_OWN, MUTE_ALL = Mute.NONE, Mute.OWN, Mute.ALL # looking up enum members on the class is slow. Compared with ==, so a plain 'own' string still routes right
+
+class RoutingIndex:
+    ''' This class keeps the recipient sets of the message routing up to date. Instead of walking all chats for every message,
+    each chat is classified once when it changes. Routing a message then only costs the number of recipients. '''
+
+    def __init__(self, chats, users):
+        ''' Build the index for the given chat and user databases. The index keeps a reference to them and reads them on updates.
+        Nobody is operating until an OperatorIndex is set with setOperators(). '''
+        self._chats = chats
+        self._users = users
+        self._operators = None # the OperatorIndex of the bot, it knows who is operating
+        self._lock = threading.Lock() # updates arrive from the Telegram handlers and the Win-Test listener
+        self._wtAll = set() # chats which receive every Win-Test message
+        self._wtOwn = set() # chats which receive Win-Test messages only while their user is not operating
+        self._tgAll = set() # chats which receive every relayed Telegram message
+        self._tgOwn = set() # chats which receive relayed Telegram messages only while their user is not operating
+        self._names = {} # chat -> display name (upper case) of the user, for all chats with mute 'own'
+        self._byName = {} # display name -> set of chats with mute 'own' of users with this name
+        self._muted = set() # chats with mute 'own' whose user is operating right now
+        self._digest = set() # chats in digest mode, they receive Win-Test messages through the digest
+        self._wtRecipients = None # cached results, invalidated on every update
+        self._wtDigestRecipients = None
+        self._tgRecipients = None
+        self.rebuild()
+
+    def rebuild(self):
+        ''' Classify all chats from scratch '''
+        with self._lock:
+            for chat in list(self._names):
+                self._unindex(chat)
+            self._wtAll.clear()
+            self._tgAll.clear()
+            for chat in list(self._chats):
+                self._index(chat)
+            self._invalidate()
+
+    def updateChat(self, chat):
+        ''' Re-classify a single chat after it was created or changed '''
+        with self._lock:
+            self._unindex(chat)
+            self._index(chat)
+            self._invalidate()
+
+    def updateUser(self, user):
+        ''' Re-classify the chat of a user after the user changed '''
+        if self._users.get(user) != None and self._users[user].chat_id != '':
+            self.updateChat(self._users[user].chat_id)
+
+    def removeChat(self, chat):
+        ''' Remove a chat from all recipient sets '''
+        with self._lock:
+            self._unindex(chat)
+            self._invalidate()
+
+    def setOperators(self, operators):
+        ''' Use the given OperatorIndex to find out who is operating and re-classify all chats '''
+        self._operators = operators
+        self.rebuild()
+
+    def operatorChanged(self, oldCall, newCall):
+        ''' An operator logged out (oldCall) and/or logged in (newCall) on a station, call this after the OperatorIndex was changed. Empty calls are ignored. '''
+        with self._lock:
+            oldCall = oldCall.upper()
+            newCall = newCall.upper()
+            if oldCall == newCall:
+                return
+            if oldCall != '' and not self._isOperating(oldCall): # the operator left the last station
+                self._muted.difference_update(self._byName.get(oldCall, ()))
+            if newCall != '' and self._isOperating(newCall):
+                self._muted.update(self._byName.get(newCall, ()))
+            self._invalidate()
+
+    def wtRecipients(self):
+        ''' Returns the set of chats which receive a Win-Test message right away, the chats in digest mode are not included '''
+        recipients = self._wtRecipients
+        if recipients == None:
+            with self._lock:
+                recipients = self._wtRecipients = frozenset(self._wtAll.union(self._wtOwn - self._muted) - self._digest)
+        return recipients
+
+    def wtDigestRecipients(self):
+        ''' Returns the set of chats in digest mode which receive a Win-Test message '''
+        recipients = self._wtDigestRecipients
+        if recipients == None:
+            with self._lock:
+                recipients = self._wtDigestRecipients = frozenset(self._wtAll.union(self._wtOwn - self._muted) & self._digest)
+        return recipients
+
+    def tgRecipients(self, origin = None):
+        ''' Returns the set of chats which receive a Telegram message relayed from the chat `origin` '''
+        recipients = self._tgRecipients
+        if recipients == None:
+            with self._lock:
+                recipients = self._tgRecipients = frozenset(self._tgAll.union(self._tgOwn - self._muted))
+        if origin in recipients:
+            return recipients - {origin}
+        return recipients
+
+    def _isOperating(self, name):
+        return self._operators != None and name != '' and self._operators.isOperating(name)
+
+    def _invalidate(self):
+        self._wtRecipients = None
+        self._wtDigestRecipients = None
+        self._tgRecipients = None
+
+    def _index(self, chat):
+        ''' Put a chat into the recipient sets it belongs to. Needs the lock. '''
+        data = self._chats.get(chat)
+        if data == None:
+            return
+        own = False
+        mute = data.mute
+        if data.digest == True:
+            self._digest.add(chat)
+        if data.valid == True:
+            if mute == MUTE_NONE:
+                self._wtAll.add(chat)
+            elif data.is_private == True and mute == MUTE_OWN:
+                self._wtOwn.add(chat)
+                own = True
+        if data.tg_to_tg == True and mute != MUTE_ALL:
+            if data.is_private == False or mute != MUTE_OWN:
+                self._tgAll.add(chat)
+            else:
+                self._tgOwn.add(chat)
+                own = True
+        if own:
+            user = self._users.get(data.user)
+            name = user.wt_dispname.upper() if user != None else ''
+            self._names[chat] = name
+            self._byName.setdefault(name, set()).add(chat)
+            if self._isOperating(name):
+                self._muted.add(chat)
+
+    def _unindex(self, chat):
+        ''' Remove a chat from all recipient sets. Needs the lock. '''
+        self._wtAll.discard(chat)
+        self._wtOwn.discard(chat)
+        self._tgAll.discard(chat)
+        self._tgOwn.discard(chat)
+        self._muted.discard(chat)
+        self._digest.discard(chat)
+        name = self._names.pop(chat, None)
+        if name != None:
+            self._byName[name].discard(chat)
+            if not self._byName[name]:
+                self._byName.pop(name)
@@ -0,0 +1,82 @@
+''' This file provides the containers for state which is shared between the Win-Test listener, the event loop and the main thread.
+Writers publish a new, immutable snapshot instead of changing the data in place, so readers never need a lock. '''
+import threading, contextlib, collections.abc
+
+
+class CowDict(collections.abc.MutableMapping):
+    ''' A copy-on-write dict. Every write copies the current snapshot, changes the copy and publishes it with a single (atomic) assignment.
+    Reads and iterations use the snapshot which is current when they start, they never block and never see a half-done change,
+    iterating is safe even while other threads write. Writers are serialized by a lock, writing costs a copy of the dict: use it for data which
+    is read often and written rarely. The values are not copied: to keep the snapshots immutable, store immutable values or replace a value
+    instead of changing it in place. '''
+
+    __slots__ = ('_data', '_lock')
+
+    def __init__(self, data = None):
+        self._data = dict(data) if data else {}
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        ''' Returns the current contents. The returned dict is never changed and must not be modified. '''
+        return self._data
+
+    # Reads, all of them use a single snapshot. These overwrite the generic (and slower) methods of MutableMapping.
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def get(self, key, default = None):
+        return self._data.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def keys(self):
+        return self._data.keys()
+
+    def values(self):
+        return self._data.values()
+
+    def items(self):
+        return self._data.items()
+
+    def copy(self):
+        return dict(self._data)
+
+    def __repr__(self):
+        return 'CowDict(' + repr(self._data) + ')'
+
+    # Writes
+    @contextlib.contextmanager
+    def edit(self):
+        ''' Change several items at once. Yields a private copy of the dict, the changes are published together at the end of the with-block.
+        Nothing is published if the block raises an exception. '''
+        with self._lock:
+            data = self._data.copy()
+            yield data
+            self._data = data
+
+    def __setitem__(self, key, value):
+        with self.edit() as data:
+            data[key] = value
+
+    def __delitem__(self, key):
+        with self.edit() as data:
+            del data[key]
+
+    def pop(self, key, *default):
+        with self.edit() as data:
+            return data.pop(key, *default)
+
+    def update(self, *args, **kwargs):
+        with self.edit() as data:
+            data.update(*args, **kwargs)
+
+    def clear(self):
+        with self._lock:
+            self._data = {}
@@ -0,0 +1,99 @@
+''' This file provides the status board, a pinned message per chat which shows the Win-Test stations, their operators and the heartbeat.
+The message is edited when something changes instead of sending new messages. '''
+import functools
+import BOTConfiguration as cf
+
+
+class StatusBoard:
+    ''' Keeps the status boards of all chats with a board up to date. Changes only mark the board as outdated, the boards are refreshed at most
+    every TG_BOARD_INTERVAL seconds. A board is only edited if its text changed, so a storm of logins and logouts costs at most one edit per chat and interval. '''
+
+    def __init__(self, operators, isAliveHandler):
+        ''' `operators` is the OperatorIndex of the bot, `isAliveHandler` returns weather Win-Test heartbeats are received '''
+        self.operators = operators
+        self.isAlive = isAliveHandler
+        self.interval = cf.settings.tg_board_interval
+        self._loop = None
+        self._edit = None
+        self._texts = {} # langcode -> board text of the current state, cleared on every change
+        self._boards = set() # the chats with a board, only these are looked at on a refresh
+        self._shown = {} # chat -> the text its board shows, set once the edit succeeded
+        self._editing = {} # chat -> the text of the edit on its way
+        self._handle = None # the scheduled refresh, None if the boards are up to date
+        self._lastRefresh = 0
+
+    def start(self, loop, editHandler):
+        ''' Start refreshing on the given event loop. `editHandler` is called with (chatID, messageID, text) to edit a board and returns a future
+        which is resolved on the loop once the edit is done. All boards are refreshed once now. '''
+        self._boards = {chat for chat, data in cf.chats.items() if data.board != 0}
+        self._loop = loop
+        self._edit = editHandler
+        self.update()
+
+    def update(self):
+        ''' The stations, operators or the heartbeat changed. Can be called from any thread, returns immediately. '''
+        if self._loop == None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._schedule)
+        except RuntimeError: # the loop is closed, we are shutting down
+            pass
+
+    def _schedule(self):
+        ''' Runs on the loop. Schedule a refresh, unless one is scheduled already. '''
+        self._texts = {}
+        if self._handle != None:
+            return
+        delay = max(0, self._lastRefresh + self.interval - self._loop.time())
+        self._handle = self._loop.call_later(delay, self._refresh)
+
+    def _refresh(self):
+        ''' Runs on the loop. Edit all boards whose text changed. '''
+        self._handle = None
+        self._lastRefresh = self._loop.time()
+        for chat in list(self._boards):
+            data = cf.chats.get(chat)
+            if data == None or data.board == 0: # the chat was deleted or removed its board
+                self._boards.discard(chat)
+                self._shown.pop(chat, None)
+                continue
+            text = self.render(data.langcode)
+            if self._shown.get(chat) == text or self._editing.get(chat) == text: # up to date, or the edit is on its way
+                continue
+            self._editing[chat] = text
+            self._edit(chat, data.board, text).add_done_callback(functools.partial(self._edited, chat, text))
+
+    def _edited(self, chat, text, future):
+        ''' Runs on the loop. An edit is done, the board only counts as showing the text if it succeeded: otherwise the next refresh tries again. '''
+        if self._editing.get(chat) == text:
+            del self._editing[chat]
+        if chat in self._boards and not future.cancelled() and future.exception() == None:
+            self._shown[chat] = text
+
+    def render(self, langcode):
+        ''' Returns the board text in the given language. The text is built once per language and change. '''
+        text = self._texts.get(langcode)
+        if text == None:
+            lines = [cf.ml.getMessage(langcode, 'BOARD_TITLE'),
+                     cf.ml.getMessage(langcode, 'BOARD_ALIVE' if self.isAlive() else 'BOARD_DEAD'),
+                     '']
+            stations = self.operators.stations() # never changed in place, no need to copy
+            for station in sorted(stations):
+                if stations[station] != '':
+                    lines.append(cf.ml.getMessage(langcode, 'BOARD_STATION', vars={'station' : station, 'call' : stations[station]}))
+                else:
+                    lines.append(cf.ml.getMessage(langcode, 'BOARD_STATION_FREE', vars={'station' : station}))
+            if not stations:
+                lines.append(cf.ml.getMessage(langcode, 'BOARD_NO_STATIONS'))
+            text = self._texts[langcode] = '\n'.join(lines)
+        return text
+
+    def shown(self, chat, text):
+        ''' A board was created with the given text, it is not edited until the text changes '''
+        if self._loop != None:
+            self._loop.call_soon_threadsafe(self._created, chat, text)
+
+    def _created(self, chat, text):
+        ''' Runs on the loop '''
+        self._boards.add(chat)
+        self._shown[chat] = text
@@ -1,6 +1,5 @@
 import BOTConfiguration as cf
 import telegram, threading
-import os
 from telegram import Update
 from telegram.ext import (
     Application,
@@ -9,26 +8,32 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
-import asyncio
-import re, time
+import asyncio, functools
+import re
 import httpx
+from MessageDispatcher import MessageDispatcher
+from MessageSpool import MessageSpool
+from DatabaseRecords import Mute
+from MuliLanguageMessages import escapeMarkdown
 
 class TelegramChatManager:
     ''' This class provides the Chat Management used to handle all messages between Telegram and this software'''
 
-    def __init__(self, messageToWThandler, getOPsHandler, getWinTestDump):
+    def __init__(self, messageToWThandler, getWinTestDump, statusBoard):
         ''' Construct the chat manager, with an application and the basic push capability '''
-        self.bot = telegram.Bot(token=os.getenv('TELEGRAM_TOKEN'))
+        self.bot = telegram.Bot(token=cf.settings.telegram_token)
         self.username = ''
         self._loop = asyncio.new_event_loop()        
         asyncio.set_event_loop(self._loop)
         asyncio.get_event_loop().set_exception_handler(self.handleCoroutineException)
         threading.excepthook = cf.handleUncaughtException
         self.toWT = messageToWThandler
-        self.getOPs = getOPsHandler
         self.getWTdump = getWinTestDump
+        self.board = statusBoard
         self._thread = None
-        self.defaultLang = os.getenv('DEFAULT_LANG')
+        self.defaultLang = cf.settings.default_lang
+        self.spool = MessageSpool(cf.settings.spool_file_path, cf.log) # broadcasts survive a loss of the internet connection and restarts
+        self.dispatcher = MessageDispatcher(self._loop, self._sendNow, self.spool) # all outgoing messages are rate limited by the dispatcher
 
 
         async def getUsername():
@@ -36,7 +41,7 @@ class TelegramChatManager:
         # Try to get the bot's username and build the app
         try:
             self._loop.run_until_complete(getUsername())            
-            builder = Application.builder().token(os.getenv('TELEGRAM_TOKEN'))
+            builder = Application.builder().token(cf.settings.telegram_token)
             builder = builder.connect_timeout(120)
             builder = builder.connection_pool_size(1024)
             builder = builder.get_updates_connection_pool_size(1024)
@@ -56,6 +61,8 @@ class TelegramChatManager:
         self.app.add_handler(CommandHandler('mute', self.handleMute, filters=~filters.UpdateType.EDITED))
         self.app.add_handler(CommandHandler('confirm', self.handleConfirm, filters=~filters.UpdateType.EDITED))
         self.app.add_handler(CommandHandler('all', self.handleAll, filters=~filters.UpdateType.EDITED))
+        self.app.add_handler(CommandHandler('digest', self.handleDigest, filters=~filters.UpdateType.EDITED))
+        self.app.add_handler(CommandHandler('board', self.handleBoard, filters=~filters.UpdateType.EDITED))
         self.app.add_handler(CommandHandler('sudo', self.handleSudo, filters=~filters.UpdateType.EDITED)) # only in private chats
         self.app.add_handler(CommandHandler('leave', self.handleLeave, filters=~filters.UpdateType.EDITED)) 
         self.app.add_handler(CommandHandler('dump', self.handleDump, filters=~filters.UpdateType.EDITED)) # only for super users in private chats
@@ -71,10 +78,16 @@ class TelegramChatManager:
         cf.log.info('[TCM] Bot sucessfully instanciated, username: ' + self.username)
         
 
+    @property
+    def loop(self):
+        ''' The event loop of the Telegram application. It runs in its own thread once the manager is started. '''
+        return self._loop
+
     def start(self):
         ''' This function will start the polling process of the Telegram bot. '''
         def _start():
             asyncio.set_event_loop(self._loop)
+            self.dispatcher.start()
             self.app.run_polling()
         # we'll do the polling in a new thread. this encapsulates it from the rest
         self._thread = threading.Thread(target=_start)
@@ -83,17 +96,19 @@ class TelegramChatManager:
         cf.log.info('[TCM] Telegram application started')
         # Send super-users the boot message
         for user in cf.users:
-            if cf.users[user]['is_superuser'] == True:
-                chat = cf.users[user]['chat_id']
-                self.sendMessage(chat,cf.ml.getMessage(cf.chats[chat]['langcode'], 'BOT_BOOT'))
+            if cf.users[user].is_superuser == True:
+                chat = cf.users[user].chat_id
+                self.sendMessage(chat,cf.ml.getMessage(cf.chats[chat].langcode, 'BOT_BOOT'))
 
     def stop(self):
         cf.log.debug('[TCM] Stop event')
         # Send super-users the shutdown event
         for user in cf.users:
-            if cf.users[user]['is_superuser'] == True:
-                chat = cf.users[user]['chat_id']
-                self.sendMessage(chat,cf.ml.getMessage(cf.chats[chat]['langcode'], 'BOT_SHUTDOWN'), wait = True) # we'll need to wait, otherwise the program might exit without sending the message
+            if cf.users[user].is_superuser == True:
+                chat = cf.users[user].chat_id
+                self.sendMessage(chat,cf.ml.getMessage(cf.chats[chat].langcode, 'BOT_SHUTDOWN'), wait = True) # we'll need to wait, otherwise the program might exit without sending the message
+        self.dispatcher.logStatistics()
+        self.spool.close()
 
 
     def sendMessage(self, chatID, message, wait = False):
@@ -101,30 +116,51 @@ class TelegramChatManager:
         if chatID == None or chatID == '':
             return
         
-        message = telegram.helpers.escape_markdown(message, version=2)
-        message = message.replace('<b>','*', -1 if message.count('<b>') % 2 == 0 else (message.count('<b>') - 1))
-        message = message.replace('<i>','_', -1 if message.count('<i>') % 2 == 0 else (message.count('<i>') - 1))    
-
-        cf.log.debug('[TCM] Sending message: ' + message)
+        message = self.renderMessage(message)
+        cf.log.debug('[TCM] Sending message: %s', message)
 
-        async def send_message(self, chatID, message):
+        future = self.dispatcher.enqueue(chatID, message)
+        if wait:
             try:
-                await self.bot.send_message(chat_id=chatID, text=message, parse_mode='MarkdownV2')
-                await asyncio.sleep(0.1) # slight delay to avoid flooding
-            except telegram.error.BadRequest as e:
-                cf.log.warning('[TCM] The message could not be sent. Reason: ' + str(e))
-            except httpx.ConnectError:
-                cf.log.warning('[TCM] Failed to send a message to Telegram, currently no internet connection!')
-
+                future.result(timeout=10)
+            except TimeoutError:
+                cf.log.error('[TCM] Could not send a message within 10 seconds.', extra={'telegram_delivery': True})
+            except Exception: # dropped by the dispatcher, which logged the reason already
+                pass
+
+    def broadcastMessage(self, chatIDs, message):
+        ''' Send the same message to multiple chats. The message is rendered only once. Returns immediately.
+        The messages are spooled, they are sent once the internet connection is back or after a restart, unless they are older than TG_MESSAGE_TTL. '''
+        message = self.renderMessage(message)
+        cf.log.debug('[TCM] Broadcasting message to %d chats: %s', len(chatIDs), message)
+        for chatID in chatIDs:
+            self.dispatcher.enqueue(chatID, message, cf.settings.tg_message_ttl)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=256) # the same texts are sent to many chats, e.g. notifications in the language of each chat
+    def renderMessage(message):
+        ''' Escapes a message for MarkdownV2 and applies the <b> and <i> tags '''
+        message = escapeMarkdown(message)
+        message = message.replace('<b>','*', -1 if message.count('<b>') % 2 == 0 else (message.count('<b>') - 1))
+        message = message.replace('<i>','_', -1 if message.count('<i>') % 2 == 0 else (message.count('<i>') - 1))    
+        return message
+
+    def editMessage(self, chatID, messageID, message):
+        ''' Replace the text of a message sent by this bot, e.g. the status board. Returns immediately, with the future of the dispatcher. '''
+        message = self.renderMessage(message)
+        cf.log.debug('[TCM] Editing message %s: %s', messageID, message)
+        return self.dispatcher.enqueue(chatID, message, edit = messageID)
+
+    async def _sendNow(self, chatID, message, edit = None):
+        ''' Actually send an already rendered message, or edit the message with the id `edit`. This is called by the dispatcher only, which also handles the errors. '''
+        if edit == None:
+            await self.bot.send_message(chat_id=chatID, text=message, parse_mode='MarkdownV2')
+            return
         try:
-            if not wait:
-                asyncio.set_event_loop(self._loop)
-                asyncio.ensure_future(send_message(self, chatID, message))
-            else:
-                future = asyncio.run_coroutine_threadsafe(send_message(self, chatID, message), self._loop)
-                future.result() 
-        except:
-            cf.log.error('[TCM] Could not run the coroutine to send a message.')
+            await self.bot.edit_message_text(message, chat_id=chatID, message_id=edit, parse_mode='MarkdownV2')
+        except telegram.error.BadRequest as e:
+            if 'not modified' not in str(e): # the message shows this text already, e.g. after a restart
+                raise
    
 
     async def handleStart(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -134,10 +170,10 @@ class TelegramChatManager:
         chat_type = update.message.chat.type
 
         if cf.chats.get(chat_id): # chat exists in database. /start was unneccesary
-            if cf.chats[chat_id]['valid'] == True:
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(cf.chats[chat_id]['langcode'], 'RESTART_VALID'),version = 2)
+            if cf.chats[chat_id].valid == True:
+                message = cf.ml.getMarkdown(cf.chats[chat_id].langcode, 'RESTART_VALID')
             else:
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(cf.chats[chat_id]['langcode'], 'RESTART_UNVALID'),version = 2)
+                message = cf.ml.getMarkdown(cf.chats[chat_id].langcode, 'RESTART_UNVALID')
         else: # new chat
             if chat_type == 'private':
                 user = update.message.from_user.username
@@ -148,19 +184,19 @@ class TelegramChatManager:
                     langcode = self.defaultLang
                 
                 if cf.users.get(user): # we already know the user. Maybe it interacted with the bot in a group?
-                    if cf.users[user]['chat_id'] != '': # it should not have a chat set
+                    if cf.users[user].chat_id != '': # it should not have a chat set
                         cf.log.warning('[TCM] User '+ user + ' just opend a new chat, while a old chat was existent. Overriding the stored chat.')
                     cf.updateUser(user, 'chat_id', chat_id)
                     cf.newChat(chat_id, langcode=langcode, is_private=True, user=user) # open a new chat, link it to the existing user
                 else:
                     cf.newPrivateChat(user, chat_id, langcode)
                 cf.log.info('[TCM] A new private chat just started with user ' + user)
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'WELCOME_PRIVATE', vars={'name':update.message.from_user.first_name}),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'WELCOME_PRIVATE', vars={'name':update.message.from_user.first_name})
             else:
                 langcode = self.defaultLang
-                cf.newChat(chat_id, langcode=langcode, is_private=False, groupname = update.message.chat.title, mute='none')
+                cf.newChat(chat_id, langcode=langcode, is_private=False, groupname = update.message.chat.title, mute=Mute.NONE)
                 cf.log.info('[TCM] A new group chat just started: ' + update.message.chat.title)
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'WELCOME_GROUP'),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'WELCOME_GROUP')
         await update.message.reply_text(message, parse_mode='MarkdownV2')
 
     async def handleVerify(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -170,29 +206,29 @@ class TelegramChatManager:
         chat_type = update.message.chat.type
 
         if not cf.chats.get(chat_id): 
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(self.defaultLang, 'UNKNOWN_CHAT_ERROR'),version = 2)
+            message = cf.ml.getMarkdown(self.defaultLang, 'UNKNOWN_CHAT_ERROR')
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
         if await self.sanityCheck(update, silent = True):
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ALREADY_VERIFIED'),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'ALREADY_VERIFIED')
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
         
         if context.args == []: # check syntax
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'INVALID_VERIFY_SYNTAX'),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'INVALID_VERIFY_SYNTAX')
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
         key = " ".join(context.args)
-        if key == os.getenv('MAGIC_KEY'):
+        if key == cf.settings.magic_key:
             if chat_type == 'private':
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'VERIFY_SUCCESS_PRIVATE'),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'VERIFY_SUCCESS_PRIVATE')
             else: 
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'VERIFY_SUCCESS_GROUP', vars={'botuname': self.username}),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'VERIFY_SUCCESS_GROUP', vars={'botuname': self.username})
             cf.updateChat(chat_id, 'valid', True)
             cf.log.info('[TCM] New chat verified.')
         else:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'VERIFY_FAILED'),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'VERIFY_FAILED')
             cf.log.warning('[TCM] Chat verification failed, tried key: ' + key)
         await update.message.reply_text(message, parse_mode='MarkdownV2')
         
@@ -214,24 +250,24 @@ class TelegramChatManager:
                 cf.newUser(user)
                 cf.log.info('[TCM] New user interacted with this bot: ' + user)
             
-        langcode = cf.chats[chat_id]['langcode']
-        charlim = int(os.getenv('WT_STN_LIMIT')) - len(os.getenv('WT_CALL_PREFIX')) - len(os.getenv('WT_CALL_SUFFIX'))
+        langcode = cf.chats[chat_id].langcode
+        charlim = cf.settings.wt_name_limit
         if context.args == []: # if no name is specified, we'll try to use the TG username
             if len(user) <= charlim:
                 cf.updateUser(user, 'wt_dispname', user.upper())
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'NAME_SET_USERNAME', vars={'uname':user.upper()}),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'NAME_SET_USERNAME', vars={'uname':user.upper()})
                 cf.log.info('[TCM] User ' + user + ' updated its Win-Test display name to ' + user.upper())
             else:
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'NAME_SYNTAX_UNAME', vars={'uname':user.upper(),'charlim':charlim}),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'NAME_SYNTAX_UNAME', vars={'uname':user.upper(),'charlim':charlim})
                 
         else:
             dispname = " ".join(context.args)
             if len(dispname) <= charlim:
                 cf.updateUser(user, 'wt_dispname', dispname.upper())
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'NAME_SET_SUCCESS', vars={'dispname':dispname.upper()}),version = 2)  
+                message = cf.ml.getMarkdown(langcode, 'NAME_SET_SUCCESS', vars={'dispname':dispname.upper()})  
                 cf.log.info('[TCM] User ' + user + ' updated its Win-Test display name to ' + dispname.upper())             
             else:
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'NAME_SET_FAILED', vars={'charlim':charlim}),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'NAME_SET_FAILED', vars={'charlim':charlim})
         
         await update.message.reply_text(message, parse_mode='MarkdownV2')
 
@@ -252,17 +288,17 @@ class TelegramChatManager:
             if cf.users.get(user) == None:
                 cf.newUser(user)
                 cf.log.info('[TCM] New user interacted with this bot: ' + user)
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
         if context.args == []:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'LANG_SYNTAX', vars={'languages':cf.ml.getLanguagesString()}),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'LANG_SYNTAX', vars={'languages':cf.ml.getLanguagesString()})
         else:
             newLangcode = " ".join(context.args).lower()
             if cf.ml.languageSupported(newLangcode):
                 cf.updateChat(chat_id, 'langcode', newLangcode)
                 cf.log.info('[TCM] User ' + user + ' just updated the lanuage for a chat to ' + newLangcode)
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(newLangcode, 'LANG_SUCCESS'),version = 2)
+                message = cf.ml.getMarkdown(newLangcode, 'LANG_SUCCESS')
             else:
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'LANG_NOT_FOUND', vars={'languages':cf.ml.getLanguagesString()}),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'LANG_NOT_FOUND', vars={'languages':cf.ml.getLanguagesString()})
             
         await update.message.reply_text(message, parse_mode='MarkdownV2')
 
@@ -283,35 +319,35 @@ class TelegramChatManager:
             if cf.users.get(user) == None:
                 cf.newUser(user)
                 cf.log.info('[TCM] New user interacted with this bot: ' + user)
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
 
         if context.args == []:
             if chat_type == 'private':
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MUTE_SYNTAX_PRV'),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'MUTE_SYNTAX_PRV')
             else:
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MUTE_SYNTAX_GRP'),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'MUTE_SYNTAX_GRP')
         else:
             mute = " ".join(context.args).lower()
             if mute == 'all':
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MUTE_ALL'),version = 2)
-                cf.updateChat(chat_id, 'mute', 'all')
+                message = cf.ml.getMarkdown(langcode, 'MUTE_ALL')
+                cf.updateChat(chat_id, 'mute', Mute.ALL)
                 cf.log.info('[TCM] User ' + user + ' muted a chat.')
             elif mute == 'own':
                 if chat_type == 'private':
-                    message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MUTE_OWN_PRV'),version = 2)
-                    cf.updateChat(chat_id, 'mute', 'own')
+                    message = cf.ml.getMarkdown(langcode, 'MUTE_OWN_PRV')
+                    cf.updateChat(chat_id, 'mute', Mute.OWN)
                     cf.log.info('[TCM] User ' + user + ' muted his own messages.')
                 else:
-                    message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MUTE_OWN_GRP'),version = 2)
+                    message = cf.ml.getMarkdown(langcode, 'MUTE_OWN_GRP')
             elif mute == 'none':
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MUTE_NONE'),version = 2)
-                cf.updateChat(chat_id, 'mute', 'none')
+                message = cf.ml.getMarkdown(langcode, 'MUTE_NONE')
+                cf.updateChat(chat_id, 'mute', Mute.NONE)
                 cf.log.info('[TCM] User ' + user + ' unmuted a chat.')
             else:
                 if chat_type == 'private':
-                    message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MUTE_SYNTAX_PRV'),version = 2)
+                    message = cf.ml.getMarkdown(langcode, 'MUTE_SYNTAX_PRV')
                 else:
-                    message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MUTE_SYNTAX_GRP'),version = 2)
+                    message = cf.ml.getMarkdown(langcode, 'MUTE_SYNTAX_GRP')
         await update.message.reply_text(message, parse_mode='MarkdownV2')
 
     async def handleConfirm(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -331,21 +367,21 @@ class TelegramChatManager:
             if cf.users.get(user) == None:
                 cf.newUser(user)
                 cf.log.info('[TCM] New user interacted with this bot: ' + user)
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
         if context.args == []:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'CONFIRM_SYNTAX'),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'CONFIRM_SYNTAX')
         else:
             newState = " ".join(context.args).lower()
             if newState == 'on':
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'CONFIRM_ON'),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'CONFIRM_ON')
                 cf.updateChat(chat_id, 'wt_confirm', True)
                 cf.log.info('[TCM] User ' + user + ' enabled Win-Test confirmation messages.')
             elif newState == 'off':
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'CONFIRM_OFF'),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'CONFIRM_OFF')
                 cf.updateChat(chat_id, 'wt_confirm', False)
                 cf.log.info('[TCM] User ' + user + ' disabled Win-Test confirmation messages.')
             else:
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'CONFIRM_SYNTAX'),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'CONFIRM_SYNTAX')
         await update.message.reply_text(message, parse_mode='MarkdownV2')
 
     async def handleAll(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -365,21 +401,102 @@ class TelegramChatManager:
             if cf.users.get(user) == None:
                 cf.newUser(user)
                 cf.log.info('[TCM] New user interacted with this bot: ' + user)
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
         if context.args == []:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ALL_SYNTAX'),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'ALL_SYNTAX')
         else:
             newState = " ".join(context.args).lower()
             if newState == 'on':
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ALL_ON'),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'ALL_ON')
                 cf.updateChat(chat_id, 'tg_to_tg', True)
                 cf.log.info('[TCM] User ' + user + ' enabled TG to TG messages.')
             elif newState == 'off':
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ALL_OFF'),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'ALL_OFF')
                 cf.updateChat(chat_id, 'tg_to_tg', False)
                 cf.log.info('[TCM] User ' + user + ' disabled TG to TG messages.')
             else:
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ALL_SYNTAX'),version = 2)
+                message = cf.ml.getMarkdown(langcode, 'ALL_SYNTAX')
+        await update.message.reply_text(message, parse_mode='MarkdownV2')
+
+    async def handleDigest(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        ''' Handle /digest command. This enables/disables the digest mode, Win-Test messages are then collected and sent as one message. '''
+        chat_type = update.message.chat.type
+        chat_id = str(update.message.chat_id)
+        user = update.message.from_user.username
+        if user == None:
+            user = chat_id
+
+        if chat_type == 'private':
+            if not await self.sanityCheck(update):
+                return
+        else:
+            if not await self.sanityCheckGroup(update):
+                return
+            if cf.users.get(user) == None:
+                cf.newUser(user)
+                cf.log.info('[TCM] New user interacted with this bot: ' + user)
+        langcode = cf.chats[chat_id].langcode
+        if context.args == []:
+            message = cf.ml.getMarkdown(langcode, 'DIGEST_SYNTAX', vars={'window' : format(cf.settings.tg_digest_window, 'g')})
+        else:
+            newState = " ".join(context.args).lower()
+            if newState == 'on':
+                message = cf.ml.getMarkdown(langcode, 'DIGEST_ON', vars={'window' : format(cf.settings.tg_digest_window, 'g')})
+                cf.updateChat(chat_id, 'digest', True)
+                cf.log.info('[TCM] User ' + user + ' enabled the digest mode.')
+            elif newState == 'off':
+                message = cf.ml.getMarkdown(langcode, 'DIGEST_OFF')
+                cf.updateChat(chat_id, 'digest', False)
+                cf.log.info('[TCM] User ' + user + ' disabled the digest mode.')
+            else:
+                message = cf.ml.getMarkdown(langcode, 'DIGEST_SYNTAX', vars={'window' : format(cf.settings.tg_digest_window, 'g')})
+        await update.message.reply_text(message, parse_mode='MarkdownV2')
+
+    async def handleBoard(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        ''' Handle /board command. This creates/removes the status board, a pinned message showing the Win-Test stations and their operators. '''
+        chat_type = update.message.chat.type
+        chat_id = str(update.message.chat_id)
+        user = update.message.from_user.username
+        if user == None:
+            user = chat_id
+
+        if chat_type == 'private':
+            if not await self.sanityCheck(update):
+                return
+        else:
+            if not await self.sanityCheckGroup(update):
+                return
+            if cf.users.get(user) == None:
+                cf.newUser(user)
+                cf.log.info('[TCM] New user interacted with this bot: ' + user)
+        langcode = cf.chats[chat_id].langcode
+        newState = " ".join(context.args).lower()
+        if newState == 'on':
+            text = self.board.render(langcode)
+            board = await update.message.reply_text(self.renderMessage(text), parse_mode='MarkdownV2')
+            oldBoard = cf.chats[chat_id].board
+            cf.updateChat(chat_id, 'board', board.message_id)
+            self.board.shown(chat_id, text)
+            cf.log.info('[TCM] User ' + user + ' created a status board.')
+            try:
+                if oldBoard != 0: # only one board per chat, the old one is not updated anymore
+                    await context.bot.unpin_chat_message(chat_id, oldBoard)
+                await context.bot.pin_chat_message(chat_id, board.message_id, disable_notification=True)
+                return
+            except telegram.error.TelegramError as e: # e.g. the bot may not pin messages in this group
+                cf.log.info('[TCM] The status board could not be pinned. Reason: ' + str(e))
+                message = cf.ml.getMarkdown(langcode, 'BOARD_NOT_PINNED')
+        elif newState == 'off':
+            if cf.chats[chat_id].board != 0:
+                try:
+                    await context.bot.unpin_chat_message(chat_id, cf.chats[chat_id].board)
+                except telegram.error.TelegramError: # unpinned already
+                    pass
+                cf.updateChat(chat_id, 'board', 0)
+                cf.log.info('[TCM] User ' + user + ' removed the status board.')
+            message = cf.ml.getMarkdown(langcode, 'BOARD_OFF')
+        else:
+            message = cf.ml.getMarkdown(langcode, 'BOARD_SYNTAX')
         await update.message.reply_text(message, parse_mode='MarkdownV2')
 
     async def handleSudo(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -397,28 +514,28 @@ class TelegramChatManager:
             if not await self.sanityCheckGroup(update):
                 return
             
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
 
         if chat_type != 'private':
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'SUDO_GROUP'),version = 2) 
+            message = cf.ml.getMarkdown(langcode, 'SUDO_GROUP') 
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
-        if cf.users[user]['is_superuser'] == True:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'SUDO_ALREADY'),version = 2) 
+        if cf.users[user].is_superuser == True:
+            message = cf.ml.getMarkdown(langcode, 'SUDO_ALREADY') 
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
         
         if context.args == []: # check syntax
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'SUDO_SYNTAX'),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'SUDO_SYNTAX')
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
         key = " ".join(context.args)
-        if key == os.getenv('SUPER_USER_KEY'):
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'SUDO_SUCCESS'),version = 2)
+        if key == cf.settings.super_user_key:
+            message = cf.ml.getMarkdown(langcode, 'SUDO_SUCCESS')
             cf.updateUser(user, 'is_superuser', True)
             cf.log.info('[TCM] User ' + user + ' is now a superuser.')
         else:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'SUDO_FAILED'),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'SUDO_FAILED')
             cf.log.warning('[TCM] Superuser verification failed by user ' + user + ', tried key: ' + key)
         await update.message.reply_text(message, parse_mode='MarkdownV2')
 
@@ -440,13 +557,13 @@ class TelegramChatManager:
                 cf.newUser(user)
                 cf.log.info('[TCM] New user interacted with this bot: ' + user)
         
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
         cf.remove(chat_id)      
         if chat_type == 'private':
              cf.log.info('[TCM] User '+ user + ' deletet itself.')
         else:
             cf.log.info('[TCM] User '+ user + ' just removed the group ' +update.message.chat.title)
-        message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'LEAVE_SUCCESS'),version = 2)
+        message = cf.ml.getMarkdown(langcode, 'LEAVE_SUCCESS')
         await update.message.reply_text(message, parse_mode='MarkdownV2')
     
     async def handleDump(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -466,41 +583,41 @@ class TelegramChatManager:
             if cf.users.get(user) == None:
                 cf.newUser(user)
                 cf.log.info('[TCM] New user interacted with this bot: ' + user)
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
         if chat_type != 'private':
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ONLY_SUPERUSER_GRP'),version = 2) 
+            message = cf.ml.getMarkdown(langcode, 'ONLY_SUPERUSER_GRP') 
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
-        if cf.users[user]['is_superuser'] == False:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ONLY_SUPERUSER_PRV'),version = 2) 
+        if cf.users[user].is_superuser == False:
+            message = cf.ml.getMarkdown(langcode, 'ONLY_SUPERUSER_PRV') 
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
-        dump_msg =  telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'DUMP_PREFIX'),version = 2) + '\n\n'
+        dump_msg =  cf.ml.getMarkdown(langcode, 'DUMP_PREFIX') + '\n\n'
         
         for user in cf.users:
-            if cf.users[user]['chat_id'] != '':
-                data_dump =  dict(cf.users[user], **cf.chats[cf.users[user]['chat_id']])
+            if cf.users[user].chat_id != '':
+                data_dump =  dict(cf.users[user].toDict(), **cf.chats[cf.users[user].chat_id].toDict())
                 data_dump.pop('groupname') # remove the not printed keys, otherwise a warning would arise
                 data_dump.pop('chat_id')
                 data_dump.pop('is_private')
-                dump_msg += telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'DUMP_USER_PRV', vars=data_dump),version = 2) + '\n'
+                dump_msg += cf.ml.getMarkdown(langcode, 'DUMP_USER_PRV', vars=data_dump) + '\n'
             else:
-                data_dump = dict({'user':user}, **cf.users[user])
-                dump_msg += telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'DUMP_USER', vars=data_dump),version = 2) + '\n'
+                data_dump = dict({'user':user}, **cf.users[user].toDict())
+                dump_msg += cf.ml.getMarkdown(langcode, 'DUMP_USER', vars=data_dump) + '\n'
         
         anyGroup = False
         
         for chat in cf.chats:
-            if cf.chats[chat]['is_private'] == False: # remove the not printed keys, otherwise a warning would arise
+            if cf.chats[chat].is_private == False: # remove the not printed keys, otherwise a warning would arise
                 if anyGroup == False:
-                    dump_msg += '\n' + telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'DUMP_MIDFIX'),version = 2) + '\n\n'
+                    dump_msg += '\n' + cf.ml.getMarkdown(langcode, 'DUMP_MIDFIX') + '\n\n'
                     anyGroup = True
-                data_dump = dict(cf.chats[chat])
+                data_dump = cf.chats[chat].toDict()
                 data_dump.pop('is_private')
                 data_dump.pop('user')
-                dump_msg += telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'DUMP_GRPchat', vars=data_dump),version = 2) + '\n'
+                dump_msg += cf.ml.getMarkdown(langcode, 'DUMP_GRPchat', vars=data_dump) + '\n'
         data_dump = self.getWTdump()
-        dump_msg += '\n' + telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'DUMP_SUFFIX', vars=data_dump),version = 2)
+        dump_msg += '\n' + cf.ml.getMarkdown(langcode, 'DUMP_SUFFIX', vars=data_dump)
         await update.message.reply_text(dump_msg, parse_mode='MarkdownV2')
 
 
@@ -521,36 +638,33 @@ class TelegramChatManager:
             if cf.users.get(user) == None:
                 cf.newUser(user)
                 cf.log.info('[TCM] New user interacted with this bot: ' + user)
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
         if chat_type != 'private':
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ONLY_SUPERUSER_GRP'),version = 2) 
+            message = cf.ml.getMarkdown(langcode, 'ONLY_SUPERUSER_GRP') 
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
-        if cf.users[user]['is_superuser'] == False:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ONLY_SUPERUSER_PRV'),version = 2) 
+        if cf.users[user].is_superuser == False:
+            message = cf.ml.getMarkdown(langcode, 'ONLY_SUPERUSER_PRV') 
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
 
         if context.args == []: # check syntax
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MAKELEAVE_SYNTAX'),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'MAKELEAVE_SYNTAX')
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
         name = " ".join(context.args)
         if cf.users.get(name) != None:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MAKELEAVE_USER_SUCCESS', vars={'user':name}),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'MAKELEAVE_USER_SUCCESS', vars={'user':name})
             cf.removeUser(name)
             cf.log.info('[TCM] Super-user ' + user + ' just removed ' + name)
         else:
-            found = False
-            for chat in cf.chats:
-                if cf.chats[chat]['groupname'] == name:
-                    message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MAKELEAVE_GRP_SUCCESS', vars={'groupname':name}),version = 2)
-                    cf.remove(chat)
-                    cf.log.info('[TCM] Super-user ' + user + ' just removed ' + name)
-                    found = True
-                    break         
-            if not found:
-                message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MAKELEAVE_NOT_FOUND'),version = 2)
+            chat = cf.findGroupChat(name)
+            if chat != None:
+                message = cf.ml.getMarkdown(langcode, 'MAKELEAVE_GRP_SUCCESS', vars={'groupname':name})
+                cf.remove(chat)
+                cf.log.info('[TCM] Super-user ' + user + ' just removed ' + name)
+            else:
+                message = cf.ml.getMarkdown(langcode, 'MAKELEAVE_NOT_FOUND')
         await update.message.reply_text(message, parse_mode='MarkdownV2')
 
     async def handleMuteall(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -570,25 +684,26 @@ class TelegramChatManager:
             if cf.users.get(user) == None:
                 cf.newUser(user)
                 cf.log.info('[TCM] New user interacted with this bot: ' + user)
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
         if chat_type != 'private':
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ONLY_SUPERUSER_GRP'),version = 2) 
+            message = cf.ml.getMarkdown(langcode, 'ONLY_SUPERUSER_GRP') 
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
-        if cf.users[user]['is_superuser'] == False:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ONLY_SUPERUSER_PRV'),version = 2) 
+        if cf.users[user].is_superuser == False:
+            message = cf.ml.getMarkdown(langcode, 'ONLY_SUPERUSER_PRV') 
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
 
-        for chat in cf.chats:
-            if chat == chat_id:
-                continue
-            if cf.chats[chat]['mute'] != 'all':
-                cf.updateChat(chat, 'mute', 'all')
-                us_langcode = cf.chats[chat]['langcode']
-                self.sendMessage(chat, cf.ml.getMessage(us_langcode, 'MUTE_ALL_PRV' if cf.chats[chat]['is_private'] == True else 'MUTE_ALL_GRP'))
+        with cf.transaction(): # write the database only once
+            for chat in cf.chats:
+                if chat == chat_id:
+                    continue
+                if cf.chats[chat].mute != Mute.ALL:
+                    cf.updateChat(chat, 'mute', Mute.ALL)
+                    us_langcode = cf.chats[chat].langcode
+                    self.sendMessage(chat, cf.ml.getMessage(us_langcode, 'MUTE_ALL_PRV' if cf.chats[chat].is_private == True else 'MUTE_ALL_GRP'))
             
-        message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'MUTE_ALL_SUCCESS'),version = 2)
+        message = cf.ml.getMarkdown(langcode, 'MUTE_ALL_SUCCESS')
         cf.log.info('[TCM] Super-User ' + user + ' just muted all chats.')
         await update.message.reply_text(message, parse_mode='MarkdownV2')
 
@@ -609,20 +724,20 @@ class TelegramChatManager:
             if cf.users.get(user) == None:
                 cf.newUser(user)
                 cf.log.info('[TCM] New user interacted with this bot: ' + user)
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
         if chat_type != 'private':
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ONLY_SUPERUSER_GRP'),version = 2) 
+            message = cf.ml.getMarkdown(langcode, 'ONLY_SUPERUSER_GRP') 
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
-        if cf.users[user]['is_superuser'] == False:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ONLY_SUPERUSER_PRV'),version = 2) 
+        if cf.users[user].is_superuser == False:
+            message = cf.ml.getMarkdown(langcode, 'ONLY_SUPERUSER_PRV') 
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
 
         cf.updateUser(user, 'is_superuser', False)
         cf.updateUserLogging(user, 'none')
         cf.log.info('[TCM] Super-User ' + user + ' gave up on its super-user rights')
-        message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'TO_PLEBS'),version = 2)
+        message = cf.ml.getMarkdown(langcode, 'TO_PLEBS')
         await update.message.reply_text(message, parse_mode='MarkdownV2')
 
     async def handleLoglevel(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -642,25 +757,25 @@ class TelegramChatManager:
             if cf.users.get(user) == None:
                 cf.newUser(user)
                 cf.log.info('[TCM] New user interacted with this bot: ' + user)
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
         if chat_type != 'private':
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ONLY_SUPERUSER_GRP'),version = 2) 
+            message = cf.ml.getMarkdown(langcode, 'ONLY_SUPERUSER_GRP') 
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
-        if cf.users[user]['is_superuser'] == False:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'ONLY_SUPERUSER_PRV'),version = 2) 
+        if cf.users[user].is_superuser == False:
+            message = cf.ml.getMarkdown(langcode, 'ONLY_SUPERUSER_PRV') 
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
         
         if context.args == []: # check syntax
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'LOGLEVEL_SYNTAX'),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'LOGLEVEL_SYNTAX')
             await update.message.reply_text(message, parse_mode='MarkdownV2')
             return
         loglevel = " ".join(context.args)
         if cf.updateUserLogging(user, loglevel) == 0:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'LOGLEVEL_SUCCESS'),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'LOGLEVEL_SUCCESS')
         else:
-            message = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'LOGLEVEL_SYNTAX'),version = 2)
+            message = cf.ml.getMarkdown(langcode, 'LOGLEVEL_SYNTAX')
         await update.message.reply_text(message, parse_mode='MarkdownV2')
 
         
@@ -682,21 +797,23 @@ class TelegramChatManager:
             if cf.users.get(user) == None:
                 cf.newUser(user)
                 cf.log.info('[TCM] New user interacted with this bot: ' + user)
-        langcode = cf.chats[chat_id]['langcode']
-        settings = {'wt_dispname' : cf.users[user]['wt_dispname'],
+        langcode = cf.chats[chat_id].langcode
+        settings = {'wt_dispname' : cf.users[user].wt_dispname,
                     'languages' : cf.ml.getLanguagesString(),
-                    'mute' : cf.chats[chat_id]['mute'],
-                    'wt_confirm' : 'on' if cf.chats[chat_id]['wt_confirm'] == True else 'off',
-                    'tg_to_tg' : 'on' if cf.chats[chat_id]['tg_to_tg'] == True else 'off'}
+                    'mute' : cf.chats[chat_id].mute,
+                    'wt_confirm' : 'on' if cf.chats[chat_id].wt_confirm == True else 'off',
+                    'tg_to_tg' : 'on' if cf.chats[chat_id].tg_to_tg == True else 'off',
+                    'digest' : 'on' if cf.chats[chat_id].digest == True else 'off',
+                    'board' : 'on' if cf.chats[chat_id].board != 0 else 'off'}
         if chat_type != 'private':
             settings['botuname'] = self.username
-            message =  telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'HELP_GRP', vars=settings),version = 2) + '\n\n'
+            message =  cf.ml.getMarkdown(langcode, 'HELP_GRP', vars=settings) + '\n\n'
         else:
-            if cf.users[user]['is_superuser'] == True:
-                settings['log_level'] = cf.users[user]['log_level']
-                message =  telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'HELP_SUSER', vars=settings),version = 2) + '\n\n'
+            if cf.users[user].is_superuser == True:
+                settings['log_level'] = cf.users[user].log_level
+                message =  cf.ml.getMarkdown(langcode, 'HELP_SUSER', vars=settings) + '\n\n'
             else:
-                message =  telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'HELP_PRV', vars=settings),version = 2) + '\n\n'
+                message =  cf.ml.getMarkdown(langcode, 'HELP_PRV', vars=settings) + '\n\n'
         await update.message.reply_text(message, parse_mode='MarkdownV2')
 
         
@@ -710,43 +827,27 @@ class TelegramChatManager:
         text = update.message.text
        
         if await self.sanityCheck(update):
-            confirm = cf.chats[chat_id]['wt_confirm']
-            langcode = cf.chats[chat_id]['langcode']
-            if cf.users[username]['wt_dispname'] != '':
-                dispname = os.getenv('WT_CALL_PREFIX') + cf.users[username]['wt_dispname'] + os.getenv('WT_CALL_SUFFIX')
+            confirm = cf.chats[chat_id].wt_confirm
+            langcode = cf.chats[chat_id].langcode
+            if cf.users[username].wt_dispname != '':
+                dispname = cf.settings.wt_call_prefix + cf.users[username].wt_dispname + cf.settings.wt_call_suffix
                 msg = ''
             else:
                 dispname =  cf.ml.getMessage(self.defaultLang, 'BOT_STATION')
-                msg = cf.ml.getMessage(langcode, 'REQUEST_WTNAME', vars={'name':first_name})
+                msg = cf.ml.getMarkdown(langcode, 'REQUEST_WTNAME', vars={'name':first_name})
             resp = self._forwardToWT(dispname, text, langcode)
 
             if resp == '':
                 if confirm:
-                    resp = cf.ml.getMessage(langcode, 'WT_CONFIRM')
-                ops = self.getOPs()
-                count = 0
-                for chat in cf.chats:
-                    if chat == chat_id:
-                        continue
-                    if cf.chats[chat]['tg_to_tg'] == True and cf.chats[chat]['mute'] != 'all':
-                        if cf.chats[chat]['is_private'] == False:
-                            self.sendMessage(chat, dispname + ':\n' + text)
-                            count += 1
-                        elif not (cf.chats[chat]['mute'] == 'own' and cf.users[cf.chats[chat]['user']]['wt_dispname'] in ops):
-                            self.sendMessage(chat, dispname + ':\n' + text)
-                            count += 1
-                    
-                    if count == 25: # sending too many messages at once is not working. Just wait until we can send more! A more elegant solution may be implemented!
-                        time.sleep(8)
-                        count = 0 
+                    resp = cf.ml.getMarkdown(langcode, 'WT_CONFIRM')
+                self._relayMessage(chat_id, dispname + ':\n' + text)
 
             if msg != '' and resp != '':
-                msg += '\n\n ---- \n\n' + resp
+                msg += '\n\n \\-\\-\\-\\- \n\n' + resp # the separator is escaped already
             else:
                 msg += resp
 
-            if msg != '':
-                msg = telegram.helpers.escape_markdown(msg, version = 2)
+            if msg != '': # all parts are escaped already
                 await update.message.reply_text(msg, parse_mode='MarkdownV2')
 
 
@@ -762,51 +863,44 @@ class TelegramChatManager:
         cf.log.debug('[TCM] Group message: {} from chat_id : {}  firstname : {} lastname : {}  username: {} langcode: {}'. format(text, chat_id, first_name, last_name , username, langcode))
         
         if await self.sanityCheckGroup(update):
-            confirm = cf.chats[chat_id]['wt_confirm']
-            langcode = cf.chats[chat_id]['langcode']
-            if cf.users.get(username) and cf.users[username]['wt_dispname'] != '':
-                dispname = os.getenv('WT_CALL_PREFIX') + cf.users[username]['wt_dispname'] + os.getenv('WT_CALL_SUFFIX')
+            confirm = cf.chats[chat_id].wt_confirm
+            langcode = cf.chats[chat_id].langcode
+            if cf.users.get(username) and cf.users[username].wt_dispname != '':
+                dispname = cf.settings.wt_call_prefix + cf.users[username].wt_dispname + cf.settings.wt_call_suffix
                 msg = ''
             else:
                 dispname = cf.ml.getMessage(self.defaultLang, 'BOT_STATION')
-                msg = cf.ml.getMessage(langcode, 'REQUEST_WTNAME', vars={'name':first_name})
+                msg = cf.ml.getMarkdown(langcode, 'REQUEST_WTNAME', vars={'name':first_name})
             resp = self._forwardToWT(dispname, text, langcode)
 
             if resp == '':
                 if confirm:
-                    resp = cf.ml.getMessage(langcode, 'WT_CONFIRM')
-                ops = self.getOPs()
-                count = 0
-                for chat in cf.chats:
-                    if chat == chat_id:
-                        continue
-                    if cf.chats[chat]['tg_to_tg'] == True and cf.chats[chat]['mute'] != 'all':
-                        if cf.chats[chat]['is_private'] == False:
-                            self.sendMessage(chat, dispname + ':\n' + text)
-                            count += 1
-                        elif not (cf.chats[chat]['mute'] == 'own' and cf.users[cf.chats[chat]['user']]['wt_dispname'] in ops):
-                            self.sendMessage(chat, dispname + ':\n' + text)
-                            count += 1
-
-                    if count == 25: # sending too many messages at once is not working. Just wait until we can send more! A more elegant solution may be implemented!
-                        time.sleep(8)
-                        count = 0 
+                    resp = cf.ml.getMarkdown(langcode, 'WT_CONFIRM')
+                self._relayMessage(chat_id, dispname + ':\n' + text)
 
             if msg != '' and resp != '':
-                msg += '\n\n ---- \n\n' + resp
+                msg += '\n\n \\-\\-\\-\\- \n\n' + resp # the separator is escaped already
             else:
                 msg += resp
 
-            if msg != '':
-                msg = telegram.helpers.escape_markdown(msg, version = 2)
+            if msg != '': # all parts are escaped already
                 await update.message.reply_text(msg, parse_mode='MarkdownV2')
     
+    def _relayMessage(self, origin, message):
+        ''' Relay a Telegram message into all other chats which want to receive Telegram messages. The messages are queued with the dispatcher, this never blocks the event loop. '''
+        self.broadcastMessage(cf.routes.tgRecipients(origin), message)
+
     async def errorHandler(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         ''' If a uncaught telegram  error within a telegram message arises. '''
-        cf.log.error('[TCM] An uncaught exception in the telegram module occurred. This bot will continue to run. \nException: ' + str(context.error), exc_info=context.error)
+        cf.log.error('[TCM] An uncaught exception in the telegram module occurred. This bot will continue to run. \nException: ' + str(context.error), exc_info=context.error, extra={'telegram_delivery': self.isDeliveryError(context.error)})
 
     def handleCoroutineException(self, coro, context):
-        cf.log.error('[TCM] A coroutine failed to execute! \nException: ' + str(context['exception']), exc_info=context['exception'])
+        cf.log.error('[TCM] A coroutine failed to execute! \nException: ' + str(context['exception']), exc_info=context['exception'], extra={'telegram_delivery': self.isDeliveryError(context['exception'])})
+
+    @staticmethod
+    def isDeliveryError(error):
+        ''' Checks weather an exception is a connection problem with Telegram. Those are not reported via Telegram, see TelegramLoggingHandler. '''
+        return isinstance(error, (telegram.error.NetworkError, httpx.HTTPError)) and not isinstance(error, telegram.error.BadRequest)
             
     async def sanityCheck(self, update, silent = False):
         ''' Sanity check to limit access only to existing well-behaved users. This check is for private chats.'''
@@ -816,32 +910,32 @@ class TelegramChatManager:
             user = chat_id
 
         if not cf.chats.get(chat_id):
-            msg = telegram.helpers.escape_markdown(cf.ml.getMessage(self.defaultLang, 'UNKNOWN_CHAT_ERROR'), version = 2)
+            msg = cf.ml.getMarkdown(self.defaultLang, 'UNKNOWN_CHAT_ERROR')
             if not silent:
                 await update.message.reply_text(msg, parse_mode='MarkdownV2')
                 cf.log.warning('[TCM] Sanity check failed. Unknown chat.')
             return False
-        langcode = cf.chats[chat_id]['langcode']
+        langcode = cf.chats[chat_id].langcode
 
-        if cf.chats[chat_id]['valid'] == False:
-            msg = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'NOT_VALID_ERROR'), version = 2)
+        if cf.chats[chat_id].valid == False:
+            msg = cf.ml.getMarkdown(langcode, 'NOT_VALID_ERROR')
             if not silent:
                 await update.message.reply_text(msg, parse_mode='MarkdownV2')
                 cf.log.warning('[TCM] Sanity check failed. User not verified.')
             return False
 
-        if user != cf.chats[chat_id]['user']:
-            oldUser = cf.chats[chat_id]['user']
+        if user != cf.chats[chat_id].user:
+            oldUser = cf.chats[chat_id].user
             if cf.users.get(oldUser) != None:
                 cf.updateUsername(oldUser, user)
                 cf.log.info('[TCM] Changing username from user ' + oldUser + ' to ' + user)
             else:
                 cf.newUser(user, chat=chat_id)
 
-        if cf.chats[chat_id]['user'] != user:
+        if cf.chats[chat_id].user != user:
             cf.log.warning('[TCM] Database inconsistency. Chat points to wrong user. Fixing that.')
             cf.updateChat(chat_id, 'user', user)
-        if cf.users[user]['chat_id'] != chat_id:
+        if cf.users[user].chat_id != chat_id:
             cf.log.warning('[TCM] Database inconsistency. User points to wrong chat. Fixing that.')
             cf.updateUser(user, 'chat_id', chat_id)
 
@@ -851,14 +945,14 @@ class TelegramChatManager:
         ''' Sanity check to limit access only to existing well-behaved users. '''
         chat_id = str(update.message.chat_id)
         if not cf.chats.get(chat_id):
-            msg = telegram.helpers.escape_markdown(cf.ml.getMessage(self.defaultLang, 'UNKNOWN_CHAT_ERROR'), version = 2)
+            msg = cf.ml.getMarkdown(self.defaultLang, 'UNKNOWN_CHAT_ERROR')
             if not silent:
                 await update.message.reply_text(msg, parse_mode='MarkdownV2')
                 cf.log.warning('[TCM] Sanity check failed. Unknown chat.')
             return False
-        langcode = cf.chats[chat_id]['langcode']
-        if cf.chats[chat_id]['valid'] == False:
-            msg = telegram.helpers.escape_markdown(cf.ml.getMessage(langcode, 'NOT_VALID_ERROR'), version = 2)
+        langcode = cf.chats[chat_id].langcode
+        if cf.chats[chat_id].valid == False:
+            msg = cf.ml.getMarkdown(langcode, 'NOT_VALID_ERROR')
             if not silent:
                 await update.message.reply_text(msg, parse_mode='MarkdownV2')
                 cf.log.warning('[TCM] Sanity check failed. User not verified.')
@@ -866,18 +960,18 @@ class TelegramChatManager:
         return True
 
     def _forwardToWT(self, dispname, message, langcode):
+        ''' Send a message to Win-Test. Returns '' on success, the error message escaped for MarkdownV2 otherwise. '''
         status = self.toWT(dispname, message)
         if status == 0:
             return ''
         elif status == 1:
-            return cf.ml.getMessage(langcode, 'WT_ENCODING_ERROR')
+            return cf.ml.getMarkdown(langcode, 'WT_ENCODING_ERROR')
         elif status == 2:
-            return cf.ml.getMessage(langcode, 'WT_MSG_LONG_ERROR', vars={'charlimit':os.getenv('WT_MSG_LIMIT')})
+            return cf.ml.getMarkdown(langcode, 'WT_MSG_LONG_ERROR', vars={'charlimit':cf.settings.wt_msg_limit})
         elif status == 3:
-            charlimit = int(os.getenv('WT_STN_LIMIT')) - int(os.get('WT_CALL_PREFIX')) - int(os.get('WT_CALL_SUFFIX'))
-            return cf.ml.getMessage(langcode, 'WT_STN_LONG_ERROR', vars={'stnname': dispname, 'charlimit' : str(charlimit)})
+            return cf.ml.getMarkdown(langcode, 'WT_STN_LONG_ERROR', vars={'stnname': dispname, 'charlimit' : str(cf.settings.wt_name_limit)})
         else:
             cf.log.error('[TCM] Unknown response code from BOT!')
-            return cf.ml.getMessage(langcode, 'UNKNOWN_ERROR')
+            return cf.ml.getMarkdown(langcode, 'UNKNOWN_ERROR')
 
         
\ No newline at end of file
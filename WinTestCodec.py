@@ -0,0 +1,100 @@
+''' This file provides the Win-Test codec: the escaping scheme, the checksum and the decoding of packets.
+Packets are dispatched on their leading token, unknown packet types are rejected before any field parsing. '''
+import collections, re
+
+
+class GabPacket(collections.namedtuple('GabPacket', ('station', 'toStation', 'text'))):
+    ''' A chat message. `toStation` is empty for messages to all stations. '''
+    __slots__ = ()
+
+class LoginPacket(collections.namedtuple('LoginPacket', ('station', 'call'))):
+    ''' An operator logged in to a station '''
+    __slots__ = ()
+
+class LogoutPacket(collections.namedtuple('LogoutPacket', ('station',))):
+    ''' The operator of a station logged out '''
+    __slots__ = ()
+
+
+# A quoted field, quotes and backslashes within the field are escaped by a backslash
+FIELD_REGEX = re.compile(r'"((?:[^"\\]|\\.)*)"')
+# An escape sequence, split() returns the part after the backslash as separate item
+ESCAPE_REGEX = re.compile(r'\\(\\|"|[0-3][0-7]{2})')
+
+# Translation table for escaping: quotes and backslashes are escaped, newlines become spaces and all non-ascii latin-1 characters are written as \OCT.
+# Win-Test maps the euro sign to \200, which is a control character in latin-1. Both are escaped as \200 and de-escaped as the euro sign,
+# so escaping is not reversible for \x80.
+ESCAPE_TABLE = {ord('\\'): '\\\\', ord('"'): '\\"', ord('\n'): ' ', ord('€'): '\\200'}
+ESCAPE_TABLE.update({byte: '\\' + format(byte, '03o') for byte in range(128, 256)})
+
+# Translation table for de-escaping, from the part after the backslash to the character
+DEESCAPE_TABLE = {format(byte, '03o'): chr(byte) for byte in range(256)}
+DEESCAPE_TABLE.update({'\\': '\\', '"': '"', '200': '€'})
+
+
+def escape(msg):
+    ''' Function to escape the special Win-Test encoding scheme. Raises an UnicodeEncodeError for characters which are not in latin-1 and for the zero character. '''
+    if '\x00' in msg:
+        pos = msg.index('\x00')
+        raise UnicodeEncodeError('iso-8859-1', msg, pos, pos + 1, 'Cannot encode the zero character!')
+    escaped = msg.translate(ESCAPE_TABLE)
+    if not escaped.isascii(): # a character beyond latin-1 was left untouched, find it for the error message
+        pos = next(i for i, char in enumerate(msg) if ord(char) > 255 and char != '€')
+        raise UnicodeEncodeError('iso-8859-1', msg, pos, pos + 1, 'ordinal not in range(256)')
+    return escaped
+
+def deescape(msg):
+    ''' Function to de-escape the special Win-Test encoding scheme '''
+    if '\\' not in msg: # most messages contain no escape sequences at all
+        return msg
+    parts = ESCAPE_REGEX.split(msg) # literal, sequence, literal, sequence, ..., literal
+    parts[1::2] = map(DEESCAPE_TABLE.__getitem__, parts[1::2])
+    return ''.join(parts)
+
+def checksum(buf):
+    ''' Wintest checksum algorihm, it's ((sum of all bytes) | 128) % 256. `buf` is a bytes-like object. '''
+    return (sum(buf) | 128) % 256
+
+def encodePacket(msg):
+    ''' Encodes an (already escaped) packet into bytes and appends the checksum and the trailing zero '''
+    data = msg.encode('ascii')
+    return data + bytes((checksum(data), 0))
+
+def _fields(body, count):
+    ''' Split the body of a packet into its (still escaped) fields. Returns None if the number of fields is not `count`. '''
+    fields = FIELD_REGEX.findall(body)
+    if len(fields) != count:
+        return None
+    return fields
+
+def _decodeGab(body):
+    fields = _fields(body, 3)
+    if fields == None:
+        return None
+    return GabPacket(deescape(fields[0]), deescape(fields[1]), deescape(fields[2]))
+
+def _decodeLogin(body):
+    fields = _fields(body, 4)
+    if fields == None:
+        return None
+    return LoginPacket(deescape(fields[0]), deescape(fields[2])) # the call is the third field
+
+def _decodeLogout(body):
+    fields = FIELD_REGEX.findall(body)
+    if len(fields) != 2 and len(fields) != 4:
+        return None
+    return LogoutPacket(deescape(fields[0]))
+
+# The decoder of each packet type we care about. All other types (STATUS, ADDQSO, ...) are dropped.
+DECODERS = {'GAB': _decodeGab,
+            'LOGIN': _decodeLogin,
+            'LOGOUT': _decodeLogout}
+
+
+def decode(msg):
+    ''' Decodes a Win-Test packet (without checksum and trailing zero). Returns a packet object or None if the packet type is not handled or the packet is malformed. '''
+    kind, sep, body = msg.partition(': ')
+    decoder = DECODERS.get(kind)
+    if decoder == None or sep == '':
+        return None
+    return decoder(body)
@@ -1,6 +1,56 @@
 import BOTConfiguration as cf
-import socket, re
-import os, threading, time, ipaddress, select
+import socket, asyncio
+import WinTestCodec
+import time, ipaddress, threading, logging
+
+class WinTestProtocol(asyncio.DatagramProtocol):
+    ''' The asyncio protocol for the Win-Test UDP broadcasts. Every received datagram is passed to the handler. '''
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def datagram_received(self, data, addr):
+        self.handler.handlePacket(data)
+
+    def error_received(self, exc):
+        cf.log.warning('[WT] Network error while listening to Win-Test: ' + str(exc))
+
+    def connection_lost(self, exc):
+        if exc != None:
+            cf.log.error('[WT] Win-Test listener closed unexpectedly, reason: ' + str(exc))
+        self.handler.running = False
+
+class EchoCache:
+    ''' As we send our own messages to a broadcast IP, we will receive our own messages aswell. This cache remembers the packets we sent
+    for `ttl` seconds, so their echoes can be filtered. At most `capacity` packets are kept, the oldest ones are dropped first. '''
+
+    def __init__(self, ttl, capacity):
+        self.ttl = ttl
+        self.capacity = capacity
+        self._entries = {} # packet -> expiry time, in insertion order and thus ordered by expiry
+        self._lock = threading.Lock()
+
+    def add(self, packet):
+        ''' Remember a packet we are about to send '''
+        with self._lock:
+            now = time.monotonic()
+            self._entries.pop(packet, None) # re-insert to keep the order by expiry
+            self._entries[packet] = now + self.ttl
+            # drop expired entries from the front, and the oldest ones if we are over the capacity
+            while self._entries:
+                oldest = next(iter(self._entries))
+                if self._entries[oldest] > now and len(self._entries) <= self.capacity:
+                    break
+                del self._entries[oldest]
+
+    def __contains__(self, packet):
+        ''' Checks weather the packet is an echo of one we sent. Readers don't need the lock. '''
+        expiry = self._entries.get(packet)
+        return expiry != None and expiry > time.monotonic()
+
+    def __len__(self):
+        return len(self._entries)
+
 
 class WinTestHandler:
     ''' This class provides the handling of wintest messages, reception and infusing the wintest network with additional messages. '''
@@ -17,30 +67,34 @@ class WinTestHandler:
         ''' Raised when it's tried to send a message with a invalid message length '''
         pass
 
-    # REGEX for the incoming messages
-    GAB_REGEX = r'^GAB: "(.*)" "(.*)" "(.*)"$'
-    LOG_REGEX = r'^LOG(IN|OUT): "([^"]*)" "([^"]*)"(?: "([^"]*)" "([^"]*)")?$'
+    RCVBUF_SIZE = 1024 * 1024 # socket receive buffer, large enough to hold the bursts of a busy contest
 
 
-    def __init__(self, newMessageHandler, opChangeHandler):
-        '''  Constructor to setup the handler. '''
+    def __init__(self, newMessageHandler, opChangeHandler, heartbeatHandler = None):
+        '''  Constructor to setup the handler. The optional `heartbeatHandler` is called whenever the heartbeat got lost or came back. '''
         self.newMessageHandler = newMessageHandler
         self.opChangeHandler = opChangeHandler 
+        self.heartbeatHandler = heartbeatHandler
         # setup the flags
-        self._stop_event = False
         self.running = False
-        self._thread = None
-        self._wdTherad = None
+        self._loop = None
+        self._transport = None
+        self._wdTask = None
         self.wdFlag = False
         self._last_packet = 0.0
-        self._ownMessages = [] # as we send our own messages to a broadcast IP, we will receive our own messages aswell. Use this list to filter incoming messages
+        self._ownMessages = EchoCache(cf.settings.wt_echo_ttl, cf.settings.wt_echo_capacity) # filter for the echoes of our own broadcasts
+        self._target = (cf.settings.broadcast_ip, cf.settings.broadcast_port)
+        self._traceEvery = cf.settings.wt_packet_log_sample # log every n-th received packet on DEBUG level, 0 to log none
+        self._traceCount = 0
+        self._sendSock = None # one broadcast socket is used for all messages we send
+        self._sendLock = threading.Lock() # messages are sent from the event loop and the main thread
         # Find the IP of this machine which is within the Win-Test Subnet
         hostname = socket.gethostname()
         ip_addresses = socket.gethostbyname_ex(hostname)[2]
 
         # Convert the broadcast IP and subnet mask to IPv4Address objects
-        broadcast_ip = ipaddress.IPv4Address(os.getenv('BROADCAST_IP'))
-        subnet_mask = ipaddress.IPv4Address(os.getenv('WINTEST_SUBNET'))
+        broadcast_ip = ipaddress.IPv4Address(cf.settings.broadcast_ip)
+        subnet_mask = ipaddress.IPv4Address(cf.settings.wintest_subnet)
         network_address = int(broadcast_ip) & int(subnet_mask)
         cf.log.debug('[WT] Target Subnet: ' + str(broadcast_ip))
         # Check if each assigned IP is in the same subnet as the broadcast IP
@@ -56,219 +110,184 @@ class WinTestHandler:
             cf.log.fatal('[WT] This machine has no ip address in the same subnet as Win-Test, unable to execute.')
             raise WinTestHandler.IPNotFoundException()
 
-    def start(self):
-        ''' Function to start the event loop, this will start listening to incoming packets. Returns True if the start was successfull, Flase otherwise '''
-        self._stop_event = False
-        if self.running == False:
-            cf.log.debug('[WT] Start event')
-            self._thread = threading.Thread(target=self.listen)
-            self._thread.start()
-            startT = time.time()
-            while self.running == False:
-                if time.time() - startT > 10:
-                    cf.log.error('[WT] Network listener did not start within 10 seconds! Aborting.')
-                    self.stop()
-                    return False
-                time.sleep(0.1)
-            # Start the watchdog, set is as triggered
-            self.wdFlag = True
-            self._last_packet = 0.0
-            self._wdTherad = threading.Thread(target=self.watchdog)
-            self._wdTherad.start()
-            return True
-        return False
+    def start(self, loop):
+        ''' Function to start listening to incoming packets on the given (running) event loop. Returns True if the start was successfull, False otherwise '''
+        if self.running:
+            return False
+        cf.log.debug('[WT] Start event')
+        self._loop = loop
+        try:
+            asyncio.run_coroutine_threadsafe(self._open(), loop).result(timeout=10)
+        except Exception as e:
+            cf.log.fatal('[WT] Cannot listen to incoming messages! Aborting! Reason: ' + str(e))
+            return False
+        return True
 
     def stop(self):
-        ''' Function to stio the event loop, this will try to join the thread, this function may wait up to 7 sec. '''
-        self._stop_event = True
+        ''' Function to stop listening. This closes the socket and the watchdog right away. '''
         cf.log.debug('[WT] Stop event')
+        with self._sendLock:
+            if self._sendSock != None:
+                self._sendSock.close()
+                self._sendSock = None
+        if not self.running or self._loop == None:
+            return
         try:
-            self._wdTherad.join(timeout=2)
-            self._thread.join(timeout=5) # If the wintest instance is closed, this will probably fail as we are still waiting for packets.. Not that much of an issue I think
+            asyncio.run_coroutine_threadsafe(self._close(), self._loop).result(timeout=2)
         except:
-            pass # We really don't care, if this thread really closed gracefully to be honest. 
+            pass # We really don't care, if the listener really closed gracefully to be honest.
 
-    def listen(self):
-        ''' Listening thread function. This will wait for incoming packets and call the corresponding event handlers. Stopped by the stop() function. '''
-        cf.log.info('[WT] Win-Test listening started')
-        
+    async def _open(self):
+        ''' Opens the UDP endpoint and starts the watchdog. Runs on the event loop. '''
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) 
-            sock.bind((self.ip, int(os.getenv('BROADCAST_PORT'))))
-        except Exception as e:
-            cf.log.fatal('[WT] Cannot listen to incoming messages! Aborting!') 
-        finally:
-            self._stop_event = False
-            self.running = False
-
-        sock.setblocking(0) # non-blocking performacne allows for gracefully shutdowns
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.RCVBUF_SIZE)
+        except OSError:
+            cf.log.debug('[WT] Could not enlarge the receive buffer.')
+        sock.bind((self.ip, cf.settings.broadcast_port))
+        self._transport, _ = await self._loop.create_datagram_endpoint(lambda: WinTestProtocol(self), sock=sock)
         self.running = True
+        cf.log.info('[WT] Win-Test listening started')
+        # Start the watchdog, set is as triggered
+        self.wdFlag = True
+        self._last_packet = 0.0
+        self._wdTask = self._loop.create_task(self.watchdog())
+
+    async def _close(self):
+        ''' Closes the UDP endpoint and the watchdog. Runs on the event loop. '''
+        if self._wdTask != None:
+            self._wdTask.cancel()
+            self._wdTask = None
+        if self._transport != None:
+            self._transport.close()
+            self._transport = None
+        self.running = False
+        self.wdFlag = False
+        cf.log.info('[WT] Win-Test listening stopped')
 
+    def handlePacket(self, data):
+        ''' Handles a single datagram received from Win-Test and calls the corresponding event handlers. '''
         try:
-            while self._stop_event == False:
-                ready, _, _ = select.select([sock], [], [], 1.0)  # 1-second timeout
-                if ready:
-                    data, addr = sock.recvfrom(1024) # buffer size is 1024 bytes
-                    cf.log.debug("[WT] Received message from Win-Test: %s" % data)
-
-                    if data in self._ownMessages: # It's one of our own, ignore
-                        continue
-
-                    # The last byte is always the 0 byte, check it
-                    if data[-1] != 0:
-                        cf.log.debug('[WT] Received message is not in the correct format. Maybe it\'s a DX Cluster message. ')
-                        continue
-
-                    # Extract message, expected checksum and received checksum
-                    msg = data[:-2].decode('ascii')
-                    expChecksum = self.getChecksum(msg)
-                    chkSum = data[-2]
-                    
-                    # chek the sum
-                    if expChecksum != chkSum:
-                        cf.log.warning('[WT] Wrong checksum received!')
-                        continue
-                
-                    # reset watchdog
-                    self._last_packet = time.time()
-
-                    # GAB Message
-                    m = re.match(self.GAB_REGEX, msg)
-                    if m:
-                        station = self.deescapeWT(m.group(1))
-                        toStation = self.deescapeWT(m.group(2))
-                        if toStation != '': # keep private messages private
-                            continue
-                        text = self.deescapeWT(m.group(3))
-                        if text != '': # ignore empty messages
-                            cf.log.info('[WT] Message received from station ' + station + ': ' + text)
-                            self.newMessageHandler(station, text)
-                        
-                    # LOGIN / LOGOFF Message
-                    m = re.match(self.LOG_REGEX, msg)
-                    if m:
-                        station = self.deescapeWT(m.group(2))
-                        if m.group(1) == 'IN':
-                            call = self.deescapeWT(m.group(4))
-                            cf.log.info('[WT] Login from station ' + station + ' from OP ' + call)
-                            self.opChangeHandler(station, call)
-                        else:
-                            cf.log.info('[WT] Logout from station ' + station)
-                            self.opChangeHandler(station)
-
-                    # We dont care about the other messages ... yet (?)
+            if self._traceEvery and cf.log.isEnabledFor(logging.DEBUG): # packet traces are expensive at contest rates, skip them unless wanted
+                self._traceCount += 1
+                if self._traceCount >= self._traceEvery:
+                    self._traceCount = 0
+                    cf.log.debug('[WT] Received message from Win-Test: %s', data)
+
+            if data in self._ownMessages: # It's one of our own, ignore
+                return
+
+            # The last byte is always the 0 byte, check it
+            if data[-1] != 0:
+                cf.log.debug('[WT] Received message is not in the correct format. Maybe it\'s a DX Cluster message. ')
+                return
+
+            # chek the sum, it's computed on the raw bytes
+            if WinTestCodec.checksum(memoryview(data)[:-2]) != data[-2]:
+                cf.log.warning('[WT] Wrong checksum received!')
+                return
+            msg = data[:-2].decode('ascii')
+        
+            # reset watchdog
+            self._last_packet = time.time()
+
+            packet = WinTestCodec.decode(msg)
+            if packet == None: # We dont care about the other messages ... yet (?)
+                return
+
+            # GAB Message
+            if type(packet) is WinTestCodec.GabPacket:
+                if packet.toStation != '': # keep private messages private
+                    return
+                if packet.text != '': # ignore empty messages
+                    cf.log.info('[WT] Message received from station %s: %s', packet.station, packet.text)
+                    self.newMessageHandler(packet.station, packet.text)
+
+            # LOGIN / LOGOFF Message
+            elif type(packet) is WinTestCodec.LoginPacket:
+                cf.log.info('[WT] Login from station %s from OP %s', packet.station, packet.call)
+                self.opChangeHandler(packet.station, packet.call)
+            elif type(packet) is WinTestCodec.LogoutPacket:
+                cf.log.info('[WT] Logout from station %s', packet.station)
+                self.opChangeHandler(packet.station)
         except Exception as e:
-            cf.log.error('[WT] An error occured while trying to read messages, reason: ' + str(e))
-        finally:
-            sock.close()
-            self._stop_event = False
-            self.running = False
-        cf.log.info('[WT] Win-Test listening stopped')
+            cf.log.error('[WT] An error occured while trying to read messages, reason: %s', e)
 
 
-    def watchdog(self):
+    async def watchdog(self):
         ''' Simple watchdog which will alert when WT stops sending heartbeats'''
 
         while self.running:
-            if time.time() - self._last_packet > float(os.getenv('WT_WD_TIMEOUT')):
+            if time.time() - self._last_packet > cf.settings.wt_wd_timeout:
                 if self.wdFlag == False:
                     cf.log.warning('[WT] Watchdog timeout! Win-Test heartbeat missing!') # TODO: Maybe do more... 
                     self.wdFlag = True
+                    if self.heartbeatHandler != None:
+                        self.heartbeatHandler()
             elif self.wdFlag == True:
                 self.wdFlag = False
                 cf.log.info('[WT] Got Win-Test heartbeat')
-            time.sleep(1)
+                if self.heartbeatHandler != None:
+                    self.heartbeatHandler()
+            await asyncio.sleep(1)
         self.wdFlag = False
 
 
     def sendToWT(self, source, message):
         ''' Function to send a message to Win-Test as a station `source` 
         Raises:InvalidStationLengthException, InvalidMessageLengthException, UnicodeEncodeErrorException '''
+        self.sendManyToWT([(source, message)])
+
+    def sendManyToWT(self, messages):
+        ''' Function to send multiple messages to Win-Test at once. `messages` is a list of (source, message) tuples.
+        All messages are checked before the first one is sent, if any of them is invalid nothing is sent.
+        Raises:InvalidStationLengthException, InvalidMessageLengthException, UnicodeEncodeErrorException '''
 
-        if len(source) > int(os.getenv('WT_STN_LIMIT')):
-            raise WinTestHandler.InvalidStationLengthException()
-        if len(message) > int(os.getenv('WT_MSG_LIMIT')):
-            raise WinTestHandler.InvalidMessageLengthException()
+        packets = []
+        for source, message in messages:
+            if len(source) > cf.settings.wt_stn_limit:
+                raise WinTestHandler.InvalidStationLengthException()
+            if len(message) > cf.settings.wt_msg_limit:
+                raise WinTestHandler.InvalidMessageLengthException()
 
-        if message == '':
+            if message == '':
+                continue
+            
+            # Now escape special characters for wintest and build cmd
+            cmd = 'GAB: "' + self.escapeWT(source) + '" "" "' + self.escapeWT(message) + '"'
+            packets.append(self.toUDPmsg(cmd)) # encode and append checksum
+
+        if not packets:
             return
-        
-        # Now escape special characters for wintest
-        message = self.escapeWT(message)
-        source = self.escapeWT(source)
-        
-        # build cmd
-        cmd = 'GAB: "' + source + '" "" "' + message + '"'
-        cmd = self.toUDPmsg(cmd) # encode and append checksum
-        self._ownMessages.append(cmd)
-        while len(self._ownMessages) > 5:
-            self._ownMessages.pop(0)
-        # Send it
+        for cmd in packets:
+            self._ownMessages.add(cmd)
+        # Send them
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM) 
-            sock.sendto(cmd, (os.getenv('BROADCAST_IP'),int(os.getenv('BROADCAST_PORT'))))            
+            with self._sendLock:
+                if self._sendSock == None:
+                    self._sendSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                    self._sendSock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+                for cmd in packets:
+                    self._sendSock.sendto(cmd, self._target)
         except Exception as e:
             cf.log.error('[WT] Could not send message! Reason: ' + str(e))
 
     @staticmethod
     def escapeWT(msg):
         ''' Function to escape the special Win-Test encoding scheme '''
-        # First handle special characters
-        msg = msg.replace('\\', '\\\\')
-        msg = msg.replace('"', '\\"')
-        msg = msg.replace('€', '\\200')
-        msg = msg.replace('\n', ' ')
-        escaped_string = ''
-        # now encode it latin 1 and find the special characters
-        pos = 0
-        for byte in msg.encode('iso-8859-1'): # this may raise an UnicodeEncodeError, this is expected
-            if byte > 127:
-                escaped_string += "\\" + oct(byte)[2:].zfill(3) # replace the character with the ascii sequence \\OCT 
-            elif byte == 0:
-                raise UnicodeEncodeError('iso-8859-1', msg, pos, pos, 'Cannot encode the zero character!')
-            else:
-                escaped_string += chr(byte)
-            pos += 1
-        return escaped_string
+        return WinTestCodec.escape(msg) # this may raise an UnicodeEncodeError, this is expected
 
     @staticmethod
     def deescapeWT(msg):
         ''' Function to de-escape the special Win-Test encoding scheme '''
-
-        # First replace the special characters
-        msg = msg.replace('\\"', '"')
-        msg = msg.replace('\\\\', '\\')
-        msg = msg.replace('\\200', '€')
-        
-        # define the replacement scheme
-        def replace_octal_num(match):
-            octal_number = match.group(1) # number in octal representation after the \\
-            char = chr(int(octal_number, 8)) # now encode this number into a character
-            return char
-
-        msg = re.sub(r'\\(\d{3})', replace_octal_num, msg) # replace all occurences
-        return msg
+        return WinTestCodec.deescape(msg)
 
     @staticmethod
     def toUDPmsg(msg):
         ''' Function which encodes the udp message into bytes and appends the checksum '''
-        checksum = WinTestHandler.getChecksum(msg) 
-        rbytes = bytearray(msg.encode('ascii'))
-        rbytes.append(checksum)
-        rbytes.append(0)
-
-        return bytes(rbytes)
+        return WinTestCodec.encodePacket(msg)
     
     @staticmethod
     def getChecksum(msg):
         ''' Wintest checksum algorihm, it's ((sum of all bytes) | 128) % 256 '''
-        checksum = 0   
-
-        for byte in msg.encode('ascii'):
-            checksum += byte
-            
-        checksum |= 128
-        checksum %= 256
-
-        return checksum
-        
\ No newline at end of file
+        return WinTestCodec.checksum(msg.encode('ascii'))
@@ -1,25 +1,30 @@
 import BOTConfiguration as cf
 from WinTestHandler import WinTestHandler
 from TelegramChatManager import TelegramChatManager
-import os, time, threading
+from OperatorIndex import OperatorIndex
+from MessageDigest import MessageDigest
+from StatusBoard import StatusBoard
+import time, threading
 
 class WinTestTGBot:
     ''' The Main bot class. Use this to start the bot. '''
 
-    stations = {} # keep track of the stations and who is currently op where
-
     def __init__(self):
         ''' Initialize the bot, setup all pipelines '''
+        self.operators = OperatorIndex() # keep track of the stations and who is currently op where
+        cf.routes.setOperators(self.operators) # the message routing mutes the chats of the operators
 
         try:
-            self.wt = WinTestHandler(self.incomingWTMessage, self.opChangeOnStation)  
+            self.wt = WinTestHandler(self.incomingWTMessage, self.opChangeOnStation, self.heartbeatChange)  
         except WinTestHandler.IPNotFoundException as e: # This error is catastropic, shutdown
             quit()
 
-        self.defaultLang = os.getenv('DEFAULT_LANG')
+        self.defaultLang = cf.settings.default_lang
         self.wtBOTname = cf.ml.getMessage(self.defaultLang, 'BOT_STATION')
 
-        self.tcm = TelegramChatManager(self.publishMessage, self.getOPs, self.getDataDump)
+        self.board = StatusBoard(self.operators, lambda: not self.wt.wdFlag) # the pinned status messages
+        self.tcm = TelegramChatManager(self.publishMessage, self.getDataDump, self.board)
+        self.digest = MessageDigest(cf.settings.tg_digest_window, self.tcm.broadcastMessage) # Win-Test messages for the chats in digest mode
 
         # Now as the TelegramChatManager exists successfully, give its message handler to the telegram logging handlers
         cf.messageLogCallback = self.tcm.sendMessage
@@ -31,11 +36,12 @@ class WinTestTGBot:
     def start(self):
         ''' Start the WT Handler and the TCM '''
 
-        if not self.wt.start():
-            self.log.fatal('[BOT] Could not start WinTestHandler')
+        self.tcm.start() # start the telegram polling, this also runs the event loop
+
+        if not self.wt.start(self.tcm.loop): # Win-Test is handled on the same event loop
+            cf.log.fatal('[BOT] Could not start WinTestHandler')
             return False
-        
-        self.tcm.start() # start the telegram polling      
+        self.board.start(self.tcm.loop, self.tcm.editMessage)
         try:
             while self.wt.wdFlag == True: # wait until we got a heartbeat from wintest,
                 time.sleep(0.1)
@@ -59,6 +65,7 @@ class WinTestTGBot:
     def stop(self):
         ''' Top-level stop function. This will gracefully stop all threads and handlers '''
         self._stop_event = True
+        self.digest.close() # send the buffered messages before the Telegram side stops
         self.tcm.stop()
         # Stop the WinTest Handler, send a goodbye message
         if self.wt.running:
@@ -71,49 +78,39 @@ class WinTestTGBot:
             except WinTestHandler.InvalidStationLengthException as ls:        
                 cf.log.error('[BOT] Cannot send power-down message to WT, Station Length Error!')
             self.wt.stop()
+        cf.flushDatabase() # write pending changes before we exit
         cf.log.info('[BOT] Bot stopped. Bye.')
 
 
     def incomingWTMessage(self, station, message):
         ''' If a WinTest Chat Message was captured, and parsed, handle it. '''
-        chat_msg = '<b>' + station + ((' / ' + self.stations[station]) if self.stations.get(station) else '') + '<b>'
-        chat_msg += ':\n'
-        chat_msg += message
+        op = self.operators.getOperator(station)
+        header = '<b>' + station + ((' / ' + op) if op else '') + '<b>'
         
-        if not self.stations.get(station): # we don't know this station yet. Treat it with no operators.
+        if not self.operators.knows(station): # we don't know this station yet. Treat it with no operators.
             self.opChangeOnStation(station)
 
-        count = 0
-        # go over each chat
-        for chat in cf.chats:
-
-            if cf.chats[chat]['valid'] == False: # skip uinvalid chats
-                continue
-            # All unmuted chats and chats which are not the current operator get notified
-            if cf.chats[chat]['mute'] == 'none':
-                self.tcm.sendMessage(chat, chat_msg)
-                count += 1 
-            elif cf.chats[chat]['is_private'] == True and cf.chats[chat]['mute'] == 'own':
-                if not (cf.users[cf.chats[chat]['user']]['wt_dispname'].upper() in self.getOPs()): # filter if OPs requested not to receive messages:
-                    self.tcm.sendMessage(chat, chat_msg) 
-                    count += 1 
-            
-            if count == 5: # sending too many messages at once is not working. Just wait until we can send more! A more elegant solution may be implemented!
-                time.sleep(5)
-                count = 0 
+        self.digest.add(header, message, cf.routes.wtDigestRecipients())
+        self.tcm.broadcastMessage(cf.routes.wtRecipients(), header + ':\n' + message) # returns immediately, we must not block the Win-Test listener
 
 
     def opChangeOnStation(self, station, call=''):
         ''' If a OP-Change on a station was detected, mark it. To OP-OFF a station, leave the call empty.'''        
-        self.stations[station] = call
-        cf.log.debug('[BOT] Stations update: '+ str(self.stations))
+        oldCall = self.operators.setOperator(station, call)
+        cf.routes.operatorChanged(oldCall, call)
+        cf.log.debug('[BOT] Stations update: %s', self.operators.stations()) # formatted later by the logging listener, the dict is never changed in place
+        self.board.update()
+
+    def heartbeatChange(self):
+        ''' The Win-Test heartbeat got lost or came back '''
+        self.board.update()
 
     def publishMessage(self, origin, message):
         ''' Function to publish a message to Wintest. The return code encodes potential errors: 0 -> OK, 1 -> Encoding error, 2 -> Message too long, 3 -> Station too long'''
         try:
             message = message.replace('\n', ' ') # Discard newlines
             self.wt.sendToWT(origin,message)
-            cf.log.info('[BOT] Message from ' + origin + ' sent to Win-Test: ' + message)
+            cf.log.info('[BOT] Message from %s sent to Win-Test: %s', origin, message)
             return 0
         except UnicodeEncodeError as e: # There are exception, origin of this message
             cf.log.warning('[BOT] Message could not be sent, encoding error!')
@@ -125,22 +122,15 @@ class WinTestTGBot:
             cf.log.warning('[BOT] Message could not be sent, station name too long!') 
             return 3
         
-    def getOPs(self):
-        ''' Extract the OPs which are currently logged in. '''
-        ops = []
-        for station in self.stations:
-            if self.stations[station] != '':
-                ops.append(self.stations[station].upper())
-        return ops
-    
     def getDataDump(self):
         ''' Dumps the current Win-Test state into a dict. (Heartbeat status and Staions/OPs) '''
         data_dump = {'wt_heartbeat':not self.wt.wdFlag}
         stationStr = ''
-        for station in self.stations:
+        stations = self.operators.stations()
+        for station in stations:
             stationStr += station
-            if self.stations[station] != '':
-                stationStr += ', OP: ' + self.stations[station]
+            if stations[station] != '':
+                stationStr += ', OP: ' + stations[station]
             stationStr += '\n'
         data_dump['stations'] = stationStr
         return data_dump
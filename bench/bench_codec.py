@@ -0,0 +1,49 @@
+''' Micro-benchmark of the packet decoding: the two regexes handlePacket ran on every packet before, against WinTestCodec.decode.
+Run with: python bench/bench_codec.py '''
+import re, time
+import capture
+import WinTestCodec
+
+# The parsing before the codec existed, both regexes were tried on every packet
+GAB_REGEX = r'^GAB: "(.*)" "(.*)" "(.*)"$'
+LOG_REGEX = r'^LOG(IN|OUT): "([^"]*)" "([^"]*)"(?: "([^"]*)" "([^"]*)")?$'
+
+def oldDecode(msg):
+    deescape = WinTestCodec.deescape
+    packet = None
+    m = re.match(GAB_REGEX, msg)
+    if m:
+        packet = WinTestCodec.GabPacket(deescape(m.group(1)), deescape(m.group(2)), deescape(m.group(3)))
+    m = re.match(LOG_REGEX, msg)
+    if m:
+        if m.group(1) == 'IN':
+            packet = WinTestCodec.LoginPacket(deescape(m.group(2)), deescape(m.group(4)))
+        else:
+            packet = WinTestCodec.LogoutPacket(deescape(m.group(2)))
+    return packet
+
+
+def rate(decode, messages, repeat = 5):
+    ''' Packets per second, best of `repeat` runs '''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for msg in messages:
+            decode(msg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best == None else min(best, elapsed)
+    return len(messages) / best
+
+
+def main():
+    messages = capture.messages()
+    for msg in messages: # both give the same packets, this is a benchmark of the same work
+        assert oldDecode(msg) == WinTestCodec.decode(msg), msg
+    before, after = rate(oldDecode, messages), rate(WinTestCodec.decode, messages)
+    print('%d packets, 80%% STATUS' % len(messages))
+    print('before (two regexes): %8.0f packets/s' % before)
+    print('after (codec):        %8.0f packets/s, %.1fx' % (after, after / before))
+
+
+if __name__ == '__main__':
+    main()
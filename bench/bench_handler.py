@@ -0,0 +1,53 @@
+''' Benchmark of the per-packet overhead of WinTestHandler.handlePacket with DEBUG logging off. The real handler is fed the synthetic capture.
+"before" adds the packet trace which was formatted for every packet before, even with DEBUG off. Run with: python bench/bench_handler.py '''
+import os, sys, time, tempfile
+
+# BOTConfiguration reads its settings on import. DEBUG is off: the file logs INFO, the console WARNING.
+_tmp = tempfile.mkdtemp()
+for key, value in {'BROADCAST_IP' : '127.255.255.255', 'BROADCAST_PORT' : '9871', 'WINTEST_SUBNET' : '255.0.0.0', 'TELEGRAM_TOKEN' : '123:abc',
+                   'MAGIC_KEY' : 'secret', 'SUPER_USER_KEY' : 'super', 'DEFAULT_LANG' : 'en',
+                   'LANGUAGEPACK_PATH' : os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lang', ''),
+                   'LOG_FILE_PATH' : os.path.join(_tmp, 'bot.log'), 'DATABASE_FILE_PATH' : os.path.join(_tmp, 'bot.json'),
+                   'FILE_LOGGING_LEVEL' : 'INFO', 'CONSOLE_LOGGING_LEVEL' : 'WARNING'}.items():
+    os.environ.setdefault(key, value)
+import capture
+import BOTConfiguration as cf
+from WinTestHandler import WinTestHandler
+
+
+class EagerTraceHandler(WinTestHandler):
+    ''' The handler as it was: the packet trace was formatted before the logger checked the level '''
+
+    def handlePacket(self, data):
+        cf.log.debug("[WT] Received message from Win-Test: %s" % data)
+        super().handlePacket(data)
+
+
+def perPacket(handlers, packets, repeat = 30):
+    ''' Microseconds per packet for each handler, best of `repeat` interleaved runs '''
+    best = {}
+    for _ in range(repeat):
+        for name, handler in handlers.items():
+            start = time.perf_counter()
+            for data in packets:
+                handler.handlePacket(data)
+            elapsed = (time.perf_counter() - start) / len(packets) * 1e6
+            best[name] = min(best.get(name, elapsed), elapsed)
+    return best
+
+
+def main():
+    noop = lambda *args: None
+    before = EagerTraceHandler(noop, noop)
+    before._traceEvery = 0 # only the eager trace above
+    handlers = {'before' : before, 'after' : WinTestHandler(noop, noop)}
+    packets = capture.packets()
+    status = [data for data in packets if data.startswith(b'STATUS')]
+    print('%d packets, DEBUG enabled: %s' % (len(packets), cf.log.isEnabledFor(10)))
+    for kind, sample in (('STATUS packets', status), ('full mix', packets)):
+        result = perPacket(handlers, sample)
+        print('%-15s before %.2f us/packet, after %.2f us/packet' % (kind + ':', result['before'], result['after']))
+
+
+if __name__ == '__main__':
+    main()
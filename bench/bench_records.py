@@ -0,0 +1,103 @@
+''' Benchmark of the database records at 10k chats: the plain dicts of earlier versions against the slotted Chat/User records.
+Run with: python bench/bench_records.py [number of chats] '''
+import os, sys, timeit, tracemalloc
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from DatabaseRecords import Chat, User, Mute
+from RoutingIndex import RoutingIndex, MUTE_NONE, MUTE_OWN, MUTE_ALL
+
+N = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+MUTES = ['none', 'own', 'all']
+
+
+def chatDicts():
+    ''' The chats in their on-disk form, as they were kept in memory before '''
+    return {str(i) : {'langcode' : 'en', 'valid' : True, 'mute' : MUTES[i % 3], 'is_private' : i % 2 == 0, 'user' : 'u' + str(i), 'wt_confirm' : True,
+                      'tg_to_tg' : True, 'groupname' : '', 'digest' : False, 'board' : 0} for i in range(N)}
+
+def userDicts():
+    return {'u' + str(i) : {'wt_dispname' : 'C' + str(i % 50), 'chat_id' : str(i), 'log_level' : 'none', 'is_superuser' : False} for i in range(N)}
+
+def chatRecords():
+    ''' The same chats as records, built without the dicts so the memory of the strings is counted as well '''
+    return {sys.intern(str(i)) : Chat('en', True, MUTES[i % 3], i % 2 == 0, 'u' + str(i), True, True, '', False, 0) for i in range(N)}
+
+def userRecords():
+    return {'u' + str(i) : User('C' + str(i % 50), str(i), 'none', False) for i in range(N)}
+
+
+def memory(build):
+    ''' Bytes per chat, including the keys and strings '''
+    tracemalloc.start()
+    data = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size / len(data)
+
+def best(function, number):
+    ''' Seconds per call, best of 5 '''
+    return min(timeit.repeat(function, number=number, repeat=5)) / number
+
+
+def main():
+    print('%d chats, Python %s' % (N, sys.version.split()[0]))
+    print('memory per chat:           %6.0f B (dict)  %6.0f B (slots)' % (memory(chatDicts), memory(chatRecords))) # first, the records intern their strings
+    dicts, records = chatDicts(), chatRecords()
+
+    def readDicts():
+        for data in dicts.values():
+            data['langcode']; data['valid']; data['user']
+
+    def readRecords():
+        for data in records.values():
+            data.langcode; data.valid; data.user
+
+    def classifyDicts():
+        n = 0
+        for data in dicts.values():
+            mute = data['mute']
+            if data['valid'] == True and (mute == 'none' or (data['is_private'] == True and mute == 'own')):
+                n += 1
+            if data['tg_to_tg'] == True and mute != 'all':
+                n += 1
+        return n
+
+    def classifyRecords(): # as RoutingIndex does it, with module level aliases of the members
+        n = 0
+        for data in records.values():
+            mute = data.mute
+            if data.valid == True and (mute == MUTE_NONE or (data.is_private == True and mute == MUTE_OWN)):
+                n += 1
+            if data.tg_to_tg == True and mute != MUTE_ALL:
+                n += 1
+        return n
+
+    def classifyIdentity(): # comparing by identity, only correct if all values are members
+        n = 0
+        for data in records.values():
+            mute = data.mute
+            if data.valid == True and (mute is MUTE_NONE or (data.is_private == True and mute is MUTE_OWN)):
+                n += 1
+            if data.tg_to_tg == True and mute is not MUTE_ALL:
+                n += 1
+        return n
+
+    def classifyClass(): # looking up the members on the enum class every time
+        n = 0
+        for data in records.values():
+            mute = data.mute
+            if data.valid == True and (mute == Mute.NONE or (data.is_private == True and mute == Mute.OWN)):
+                n += 1
+            if data.tg_to_tg == True and mute != Mute.ALL:
+                n += 1
+        return n
+
+    routes = RoutingIndex(records, userRecords())
+    print('3 attribute reads:         %6.2f ms (dict) %6.2f ms (slots)' % (best(readDicts, 50) * 1e3, best(readRecords, 50) * 1e3))
+    print('routing classification:    %6.2f ms (dict) %6.2f ms (slots)' % (best(classifyDicts, 50) * 1e3, best(classifyRecords, 50) * 1e3))
+    print('  mute compared with is:   %6.2f ms, with Mute.X: %.2f ms' % (best(classifyIdentity, 50) * 1e3, best(classifyClass, 50) * 1e3))
+    print('RoutingIndex.rebuild:      %6.2f ms' % (best(routes.rebuild, 10) * 1e3))
+    print('wtRecipients, cached:      %6.3f us' % (best(routes.wtRecipients, 100000) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+''' A synthetic Win-Test capture for the benchmarks. No recorded capture is available, the mix follows a busy multi-op station:
+mostly STATUS broadcasts, some relayed packets, chat messages and a few logins and logouts. '''
+import os, sys, random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import WinTestCodec
+
+
+def messages(count = 20000, seed = 0):
+    ''' Returns `count` escaped packets as strings, without checksum '''
+    rnd = random.Random(seed)
+    result = []
+    for i in range(count):
+        r = rnd.random()
+        if r < 0.80:
+            result.append('STATUS: "RUN%d" "" "0" "1" "14025" "0" "1" "0" "7" "0"' % (i % 4))
+        elif r < 0.90:
+            result.append('RCVDPKT: "RUN1" "" "ADDQSO: \\"DL1ABC\\" 14025 599 ..."')
+        elif r < 0.97:
+            result.append('GAB: "RUN%d" "" "hello world number %d caf\\351"' % (i % 4, i))
+        elif r < 0.985:
+            result.append('LOGIN: "RUN1" "" "DL%dXY" ""' % i)
+        else:
+            result.append('LOGOUT: "RUN1" ""')
+    return result
+
+def packets(count = 20000, seed = 0):
+    ''' Returns the same packets as datagrams, with checksum and the trailing zero '''
+    return [WinTestCodec.encodePacket(msg) for msg in messages(count, seed)]
@@ -0,0 +1,71 @@
+''' Tests for the rotating log file handler. Run with: python -m unittest discover tests '''
+import os, sys, time, gzip, logging, tempfile, threading, unittest
+from unittest import mock
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+# BOTConfiguration reads its settings on import, run it in a scratch directory
+_tmp = tempfile.mkdtemp()
+_lang = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lang', '')
+for key, value in {'BROADCAST_IP' : '127.255.255.255', 'BROADCAST_PORT' : '9871', 'WINTEST_SUBNET' : '255.0.0.0', 'TELEGRAM_TOKEN' : '123:abc',
+                   'MAGIC_KEY' : 'secret', 'SUPER_USER_KEY' : 'super', 'DEFAULT_LANG' : 'en', 'LANGUAGEPACK_PATH' : _lang,
+                   'LOG_FILE_PATH' : os.path.join(_tmp, 'bot.log'), 'DATABASE_FILE_PATH' : os.path.join(_tmp, 'bot.json')}.items():
+    os.environ.setdefault(key, value)
+import BOTConfiguration as cf
+
+
+class TestRotation(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.log')
+
+    def _write(self, handler, count):
+        for i in range(count):
+            handler.emit(logging.makeLogRecord({'msg' : 'line %04d ' % i + 'x' * 40, 'levelno' : logging.INFO, 'levelname' : 'INFO'}))
+
+    def _finish(self, handler):
+        ''' Wait for the background jobs, then run a last cleanup '''
+        for thread in threading.enumerate():
+            if thread.name == 'LogCompressor':
+                thread.join()
+        handler._housekeeping()
+        handler.close()
+
+    def _lines(self):
+        ''' The numbers of all lines which were kept, in the old files and the current one '''
+        numbers = []
+        for name in os.listdir(self.dir):
+            opener = gzip.open if name.endswith('.gz') else open
+            with opener(os.path.join(self.dir, name), 'rt', encoding='utf-8') as f:
+                numbers += [int(line.split()[1]) for line in f if line.startswith('line ')]
+        return sorted(numbers)
+
+    def test_keeps_newest_within_one_second(self):
+        now = time.time()
+        with mock.patch('time.time', return_value=now), mock.patch('time.time_ns', return_value=int(now * 1e9)): # all rotations in the same instant
+            handler = cf.LogFileHandler(self.path, 'INFO', 2000, 0, 3)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._write(handler, 300)
+            self._finish(handler)
+        old = [name for name in os.listdir(self.dir) if name != 'test.log']
+        self.assertEqual(len(old), 3)
+        self.assertEqual(len(set(old)), 3)
+        lines = self._lines()
+        self.assertEqual(lines[-1], 299) # the newest lines are kept
+        self.assertEqual(lines, list(range(lines[0], 300))) # and nothing in between is missing
+
+    def test_names_increase(self):
+        handler = cf.LogFileHandler(self.path, 'INFO', 0, 0, 3)
+        with mock.patch('time.time_ns', return_value=1700000000 * 10**9):
+            names = [handler._segmentName(self.path) for _ in range(5)]
+        self._finish(handler)
+        self.assertEqual(names, sorted(names, key=lambda name: cf.LogFileHandler._age(name[len(self.path) + 1:])))
+        self.assertEqual(len(set(names)), 5)
+
+    def test_old_names_are_older(self):
+        self.assertLess(cf.LogFileHandler._age('3.gz'), cf.LogFileHandler._age('1.gz'))
+        self.assertLess(cf.LogFileHandler._age('1'), cf.LogFileHandler._age('20240101-000000-000000.gz'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+''' Tests for the routing index. Run with: python -m unittest discover tests '''
+import os, sys, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from DatabaseRecords import Chat, User, Mute
+from RoutingIndex import RoutingIndex
+from OperatorIndex import OperatorIndex
+
+
+class TestMute(unittest.TestCase):
+
+    def _index(self, mute):
+        chats = {'1' : Chat('en', True, Mute.OWN, True, 'user', True, True, '')}
+        users = {'user' : User('DL1ABC', '1')}
+        chats['1'].mute = mute # plain assignment does not convert to the enum
+        routes = RoutingIndex(chats, users)
+        routes.setOperators(OperatorIndex())
+        return routes
+
+    def _login(self, routes, station, call):
+        oldCall = routes._operators.setOperator(station, call)
+        routes.operatorChanged(oldCall, call)
+
+    def test_plain_strings_route_like_the_enum(self):
+        for mute in Mute:
+            expected = self._index(mute)
+            routes = self._index(mute.value)
+            self.assertEqual(routes.wtRecipients(), expected.wtRecipients(), mute)
+            self.assertEqual(routes.tgRecipients(), expected.tgRecipients(), mute)
+            self._login(routes, 'STN1', 'DL1ABC')
+            self._login(expected, 'STN1', 'DL1ABC')
+            self.assertEqual(routes.wtRecipients(), expected.wtRecipients(), mute)
+            self.assertEqual(routes.tgRecipients(), expected.tgRecipients(), mute)
+
+    def test_own_is_muted_while_operating(self):
+        routes = self._index('own')
+        self.assertEqual(routes.wtRecipients(), {'1'})
+        self._login(routes, 'STN1', 'dl1abc')
+        self.assertEqual(routes.wtRecipients(), set())
+        self._login(routes, 'STN1', '')
+        self.assertEqual(routes.wtRecipients(), {'1'})
+
+    def test_operating_on_two_stations(self):
+        routes = self._index(Mute.OWN)
+        self._login(routes, 'STN1', 'DL1ABC')
+        self._login(routes, 'STN2', 'DL1ABC')
+        self._login(routes, 'STN1', 'DL2XYZ') # still operating on STN2
+        self.assertEqual(routes.wtRecipients(), set())
+        self._login(routes, 'STN2', '')
+        self.assertEqual(routes.wtRecipients(), {'1'})
+
+    def test_classified_while_operating(self):
+        routes = self._index(Mute.NONE)
+        self._login(routes, 'STN1', 'DL1ABC')
+        routes._chats['1'].mute = Mute.OWN
+        routes.updateChat('1') # the chat changed while its user is operating
+        self.assertEqual(routes.wtRecipients(), set())
+
+
+if __name__ == '__main__':
+    unittest.main()
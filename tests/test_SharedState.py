@@ -0,0 +1,92 @@
+''' Stress tests for the copy-on-write containers: one writer thread and several readers hammer them concurrently. Run with: python -m unittest discover tests '''
+import os, sys, time, threading, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from SharedState import CowDict
+from OperatorIndex import OperatorIndex
+
+
+class StressTest(unittest.TestCase):
+
+    DURATION = 1 # seconds
+    READERS = 4
+
+    def _run(self, write, read):
+        ''' Runs `write` on one thread and `read` on the reader threads until the time is up. Returns the errors of all threads. '''
+        stop = threading.Event()
+        errors = []
+
+        def loop(function):
+            try:
+                i = 0
+                while not stop.is_set():
+                    function(i)
+                    i += 1
+            except Exception as e: # e.g. RuntimeError: dictionary changed size during iteration
+                errors.append(e)
+                stop.set()
+
+        threads = [threading.Thread(target=loop, args=(write,))] + [threading.Thread(target=loop, args=(read,)) for _ in range(self.READERS)]
+        for thread in threads:
+            thread.start()
+        time.sleep(self.DURATION)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def test_cowdict(self):
+        shared = CowDict()
+
+        def write(i):
+            key = i % 500
+            if 'a' + str(key) in shared:
+                with shared.edit() as data: # both keys of a pair go away together
+                    del data['a' + str(key)]
+                    del data['b' + str(key)]
+            else:
+                with shared.edit() as data:
+                    data['a' + str(key)] = i
+                    data['b' + str(key)] = i
+
+        def read(i):
+            snapshot = shared.snapshot()
+            for key, value in shared.items(): # iterates the snapshot current at the start, the writer does not disturb it
+                self.assertIn(key[0], 'ab')
+            for key, value in snapshot.items():
+                if key[0] == 'a':
+                    self.assertEqual(snapshot['b' + key[1:]], value) # never half a change
+            self.assertEqual(len(snapshot) % 2, 0)
+            self.assertEqual(sum(1 for _ in snapshot), len(snapshot)) # the snapshot does not change under the reader
+
+        self.assertEqual(self._run(write, read), [])
+
+    def test_operator_index(self):
+        operators = OperatorIndex()
+        stations = ['STN' + str(n) for n in range(20)]
+
+        def write(i):
+            station = stations[i % len(stations)]
+            operators.setOperator(station, 'DL%dABC' % (i % 7) if i % 3 else '')
+
+        def read(i):
+            snapshot = operators.stations()
+            for station, call in snapshot.items():
+                self.assertIn(station, stations)
+                self.assertIsInstance(call, str)
+            self.assertEqual(sum(1 for _ in snapshot), len(snapshot))
+            for call in operators.operators(): # a snapshot as well
+                self.assertTrue(call.startswith('DL'))
+            for station in operators.stationsOf('DL1ABC'):
+                self.assertIn(station, stations)
+
+        self.assertEqual(self._run(write, read), [])
+        for station, call in operators.stations().items(): # both indexes agree once the writer stopped
+            if call != '':
+                self.assertIn(station, operators.stationsOf(call))
+        for call in operators.operators():
+            for station in operators.stationsOf(call):
+                self.assertEqual(operators.getOperator(station).upper(), call)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+''' Tests for the Win-Test codec. Run with: python -m unittest discover tests '''
+import os, sys, re, random, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import WinTestCodec
+
+# The regex the packets were parsed with before the codec existed, the decoder has to give the same results
+LOG_REGEX = r'^LOG(IN|OUT): "([^"]*)" "([^"]*)"(?: "([^"]*)" "([^"]*)")?$'
+
+
+class TestDecodeLogin(unittest.TestCase):
+
+    PACKETS = ['LOGIN: "STN1" "x" "y" "DL1ABC"',
+               'LOGIN: "RUN1" "" "DL2XYZ" ""',
+               'LOGIN: "MULT" "0" "OE3ABC/P" "1"',
+               'LOGIN: "STN\\342" "" "DK9Q" ""']
+
+    def test_call_matches_old_regex(self):
+        for msg in self.PACKETS:
+            m = re.match(LOG_REGEX, msg)
+            packet = WinTestCodec.decode(msg)
+            self.assertEqual(packet.station, WinTestCodec.deescape(m.group(2)), msg)
+            self.assertEqual(packet.call, WinTestCodec.deescape(m.group(4)), msg)
+
+    def test_call_is_third_field(self):
+        packet = WinTestCodec.decode('LOGIN: "STN1" "x" "y" "DL1ABC"')
+        self.assertEqual(packet, WinTestCodec.LoginPacket('STN1', 'y'))
+
+    def test_logout(self):
+        self.assertEqual(WinTestCodec.decode('LOGOUT: "STN1" "x"'), WinTestCodec.LogoutPacket('STN1'))
+        self.assertEqual(WinTestCodec.decode('LOGOUT: "STN1" "x" "y" "z"'), WinTestCodec.LogoutPacket('STN1'))
+
+
+class TestEscaping(unittest.TestCase):
+
+    # latin-1 without the zero character and newline (sent as a space), plus the euro sign
+    ALPHABET = [chr(c) for c in range(1, 256) if c != 10] + ['€']
+
+    def test_roundtrip(self):
+        ''' deescape(escape(x)) == x for random strings. \\x80 is excluded: Win-Test writes the euro sign as \\200 as well, it decodes as the euro sign. '''
+        alphabet = [c for c in self.ALPHABET if c != '\x80']
+        rng = random.Random(7)
+        for _ in range(5000):
+            text = ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+            escaped = WinTestCodec.escape(text)
+            self.assertTrue(escaped.isascii())
+            self.assertEqual(WinTestCodec.deescape(escaped), text)
+
+    def test_euro_ambiguity(self):
+        self.assertEqual(WinTestCodec.escape('\x80'), WinTestCodec.escape('€'))
+        self.assertEqual(WinTestCodec.deescape(WinTestCodec.escape('\x80')), '€')
+
+    def test_newline_becomes_space(self):
+        self.assertEqual(WinTestCodec.deescape(WinTestCodec.escape('a\nb')), 'a b')
+
+    def test_not_encodable(self):
+        self.assertRaises(UnicodeEncodeError, WinTestCodec.escape, 'a\x00b')
+        self.assertRaises(UnicodeEncodeError, WinTestCodec.escape, 'ab✓')
+
+
+def oldEscapeWT(msg):
+    ''' WinTestHandler.escapeWT before the codec existed, the reference for the escaping '''
+    # First handle special characters
+    msg = msg.replace('\\', '\\\\')
+    msg = msg.replace('"', '\\"')
+    msg = msg.replace('€', '\\200')
+    msg = msg.replace('\n', ' ')
+    escaped_string = ''
+    # now encode it latin 1 and find the special characters
+    pos = 0
+    for byte in msg.encode('iso-8859-1'): # this may raise an UnicodeEncodeError, this is expected
+        if byte > 127:
+            escaped_string += "\\" + oct(byte)[2:].zfill(3) # replace the character with the ascii sequence \\OCT
+        elif byte == 0:
+            raise UnicodeEncodeError('iso-8859-1', msg, pos, pos, 'Cannot encode the zero character!')
+        else:
+            escaped_string += chr(byte)
+        pos += 1
+    return escaped_string
+
+def oldGetChecksum(msg):
+    ''' WinTestHandler.getChecksum before the codec existed '''
+    checksum = 0
+    for byte in msg.encode('ascii'):
+        checksum += byte
+    checksum |= 128
+    checksum %= 256
+    return checksum
+
+
+class TestSameAsBefore(unittest.TestCase):
+    ''' The codec gives the same output as the functions it replaced, including the errors '''
+
+    # all of latin-1 including the zero character, newline and \x80, the euro sign and some characters which can not be encoded
+    ALPHABET = [chr(c) for c in range(256)] + ['€'] * 8 + ['✓', 'Ω', '€́']
+
+    def _old(self, msg):
+        ''' Returns the old escaping, or the type of the error it raised '''
+        try:
+            return oldEscapeWT(msg)
+        except UnicodeEncodeError as e:
+            return type(e)
+
+    def _new(self, msg):
+        try:
+            return WinTestCodec.escape(msg)
+        except UnicodeEncodeError as e:
+            return type(e)
+
+    def test_escape(self):
+        rng = random.Random(11)
+        errors = 0
+        for _ in range(20000):
+            text = ''.join(rng.choice(self.ALPHABET) for _ in range(rng.randint(0, 40)))
+            old = self._old(text)
+            self.assertEqual(self._new(text), old, repr(text))
+            errors += old is UnicodeEncodeError
+        self.assertGreater(errors, 1000) # the error cases are covered as well
+
+    def test_escape_plain(self):
+        for text in ['', 'CQ DL1ABC', 'a "quoted" \\ text', 'line\nbreak', 'caf\xe9 100€', '\x80\x81\xff', 'a\x00']:
+            self.assertEqual(self._new(text), self._old(text), repr(text))
+
+    def test_checksum(self):
+        rng = random.Random(13)
+        for _ in range(2000):
+            text = ''.join(chr(rng.randint(1, 127)) for _ in range(rng.randint(0, 200)))
+            self.assertEqual(WinTestCodec.checksum(text.encode('ascii')), oldGetChecksum(text))
+            self.assertEqual(WinTestCodec.checksum(memoryview(WinTestCodec.encodePacket(text))[:-2]), oldGetChecksum(text))
+
+
+if __name__ == '__main__':
+    unittest.main()